@@ -3,40 +3,40 @@ from typing import Annotated, Optional
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from jwt.exceptions import InvalidTokenError
 
-from app import models
+from app import models, user_cache
 from app.config import JWT_KEY
-from app.database import get_db
+from app.database import async_variant, get_session
+from app.hashing import verify_password_async
+from app.log_save import context as log_context
 from app.schemas import TokenData
 
 SECRET_KEY = JWT_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
 def get_user(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username)
+@async_variant(get_user)
+async def get_user_async(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).filter(models.User.username == username))
+    return result.scalars().first()
+
+
+async def authenticate_user_async(db, username: str, password: str):
+    user = await get_user_async(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -52,7 +52,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
+# The lookup fills the shared user cache for USER_CACHE_TTL, so it reads the
+# primary: a lagging replica would pin a stale balance well past DB_REPLICA_MAX_LAG.
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -66,9 +68,13 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
         token_data = TokenData(username=username)
     except InvalidTokenError:
         raise credentials_exception
-    user = get_user(db=db, username=token_data.username)
+    user = await user_cache.get_user(token_data.username)
     if user is None:
-        raise credentials_exception
+        user = await get_user_async(db=db, username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        await user_cache.set_user(user)
+    log_context.bind(user_id=user.id)
     return user
 
 
@@ -0,0 +1,201 @@
+"""Bulk user import from CSV or NDJSON, one record per line.
+
+    python -m app.bulk_import users.csv --checkpoint users.csv.progress
+
+Records need the /register fields (email, username, password, first_name,
+last_name, balance). Passwords are hashed in a dedicated pool and rows are
+written in multi-row INSERT ... ON CONFLICT DO NOTHING batches, so users
+whose email or username already exists are skipped. Each batch commits on
+its own; "processed" in the progress reports is safe to resume from.
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import os
+import sys
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud_async, schemas
+from app.config import HASH_POOL_KIND, IMPORT_BATCH_SIZE, IMPORT_HASH_WORKERS
+from app.database import get_session_factory
+from app.hashing import HashingPool, get_password_hash
+from app.log_save import logger as log_setup
+
+# Separate from the request pool so an import can't starve logins; imports
+# bound their own in-flight hashes by batch size, so no queue limit here.
+import_pool = HashingPool(HASH_POOL_KIND, IMPORT_HASH_WORKERS, sys.maxsize)
+
+
+async def decode_lines(chunks):
+    # utf-8-sig drops the BOM spreadsheet exports put before the header
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+# Whether a CSV record is still inside a quoted field after `line`. As in the
+# csv module, a quote only opens a quoted field as the field's first character
+# (so O"Neal is a plain value) and "" inside one is an escaped quote.
+def ends_in_quoted_field(line: str, quoted: bool = False):
+    field_start = not quoted
+    escaped = False
+    for char, following in zip(line, line[1:] + "\n"):
+        if escaped:
+            escaped = False
+        elif quoted:
+            if char == '"':
+                escaped = following == '"'
+                quoted = escaped
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char == ","
+    return quoted
+
+
+# Yields None for a record that can't be parsed, so record numbers (and
+# therefore resume points) stay aligned with the input. A CSV record continues
+# onto the next line while a quoted field is open, so quoted fields may span
+# lines.
+async def parse_records(lines, format: str):
+    header = None
+    partial = None
+    async for line in lines:
+        if format == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+            continue
+        if partial is not None:
+            quoted = ends_in_quoted_field(line, quoted=True)
+            line = f"{partial}\n{line}"
+            partial = None
+        elif not line.strip():
+            continue
+        else:
+            quoted = ends_in_quoted_field(line)
+        if quoted:
+            partial = line
+        elif header is None:
+            header = next(csv.reader([line]))
+        else:
+            try:
+                yield dict(zip(header, next(csv.reader([line]))))
+            except csv.Error:
+                yield None
+    if partial is not None and header is not None:
+        yield None
+
+
+def validate(record):
+    try:
+        return schemas.UserCreate.model_validate(record)
+    except ValidationError:
+        return None
+
+
+async def write_batch(session_factory, users: list[schemas.UserCreate]):
+    hashed_passwords = await asyncio.gather(*(import_pool.run(get_password_hash, user.password) for user in users))
+    rows = [
+        {**user.model_dump(exclude={"password"}), "hashed_password": hashed_password}
+        for user, hashed_password in zip(users, hashed_passwords)
+    ]
+    if isinstance(session_factory, async_sessionmaker):
+        async with session_factory() as db:
+            return await crud_async.import_users(db, rows)
+    with session_factory() as db:
+        return await crud_async.import_users(db, rows)
+
+
+# Yields a progress dict after every committed batch and once at the end.
+# Emails are deduplicated in memory across the whole import; records before
+# `start` are skipped without being validated or hashed.
+async def import_users(records, session_factory, start: int = 0, batch_size: int = IMPORT_BATCH_SIZE):
+    progress = {"processed": 0, "inserted": 0, "existing": 0, "duplicates": 0, "invalid": 0}
+    seen = set()
+    batch = []
+
+    async def flush():
+        inserted = await write_batch(session_factory, batch)
+        progress["inserted"] += inserted
+        progress["existing"] += len(batch) - inserted
+        batch.clear()
+
+    async for record in records:
+        progress["processed"] += 1
+        if progress["processed"] <= start:
+            continue
+        user = validate(record) if record is not None else None
+        if user is None:
+            progress["invalid"] += 1
+            continue
+        if user.email in seen:
+            progress["duplicates"] += 1
+            continue
+        seen.add(user.email)
+        batch.append(user)
+        if len(batch) >= batch_size:
+            await flush()
+            yield dict(progress)
+
+    if batch:
+        await flush()
+    yield {**progress, "done": True}
+
+
+async def read_file(path: str):
+    with open(path, encoding="utf-8-sig") as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
+def read_checkpoint(path: str):
+    if path and os.path.exists(path):
+        with open(path) as file:
+            return json.load(file)["processed"]
+    return 0
+
+
+def write_checkpoint(path: str, progress: dict):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(progress, file)
+    os.replace(temporary, path)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--checkpoint", help="file recording progress; an existing one resumes the import")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    log_setup.configure()
+
+    format = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    start = read_checkpoint(args.checkpoint)
+    records = parse_records(read_file(args.path), format)
+    try:
+        async for progress in import_users(records, get_session_factory(), start=start, batch_size=args.batch_size):
+            if args.checkpoint:
+                write_checkpoint(args.checkpoint, progress)
+            print(json.dumps(progress), file=sys.stderr)
+    finally:
+        import_pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,78 @@
-from aiocache import Cache
-from aiocache.serializers import PickleSerializer
+import hashlib
+import hmac
+import logging
+import time
+from urllib.parse import urlsplit
 
-cache = Cache(Cache.REDIS, serializer=PickleSerializer(), namespace="main", endpoint="localhost", port=6379)
+import jwt
+from app.config import JWT_KEY, REDIS_URL, TOKEN_CACHE_EXPIRY_MARGIN
 
+logger = logging.getLogger(__name__)
 
-async def set_token(user_id: str, token: str, ttl: int):
-    await cache.set(user_id, token, ttl=ttl)
+_caches = {}
 
-async def get_token(user_id: str):
-    return await cache.get(user_id)
+
+# Built on first use so importing the app doesn't load aiocache and redis
+def get_cache(namespace: str = "main"):
+    if namespace not in _caches:
+        from aiocache import Cache
+        from aiocache.serializers import PickleSerializer, StringSerializer
+
+        serializer = StringSerializer() if namespace == "token" else PickleSerializer()
+        _caches[namespace] = Cache(Cache.REDIS, serializer=serializer, namespace=namespace, **redis_options(REDIS_URL))
+    return _caches[namespace]
+
+
+# aiocache takes the Redis address as separate options rather than a URL
+def redis_options(url: str):
+    parts = urlsplit(url)
+    return {
+        "endpoint": parts.hostname or "localhost",
+        "port": parts.port or 6379,
+        "db": int(parts.path.strip("/") or 0),
+        "password": parts.password,
+    }
+
+
+def get_token_cache():
+    return get_cache("token")
+
+stats = {"hits": 0, "misses": 0, "errors": 0}
+
+
+# Tokens are only stored after the password was verified, so a hit under the
+# HMAC of (username, password) proves the same credentials without bcrypt.
+def token_key(username: str, password: str):
+    message = f"{username}\0{password}".encode()
+    return f"{username}:{hmac.new((JWT_KEY or '').encode(), message, hashlib.sha256).hexdigest()}"
+
+
+async def set_token(username: str, password: str, token: str):
+    expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+    ttl = int(expires_at - time.time()) - TOKEN_CACHE_EXPIRY_MARGIN
+    if ttl <= 0:
+        return
+    try:
+        await get_token_cache().set(token_key(username, password), token, ttl=ttl)
+    except Exception:
+        stats["errors"] += 1
+        logger.exception("Token cache write failed for %s", username)
+
+
+async def get_token(username: str, password: str):
+    try:
+        token = await get_token_cache().get(token_key(username, password))
+    except Exception:
+        stats["errors"] += 1
+        logger.exception("Token cache read failed for %s", username)
+        return None
+    stats["hits" if token else "misses"] += 1
+    return token
+
+
+async def invalidate_token(username: str, password: str):
+    try:
+        await get_token_cache().delete(token_key(username, password))
+    except Exception:
+        stats["errors"] += 1
+        logger.exception("Token cache invalidation failed for %s", username)
@@ -0,0 +1,33 @@
+import logging
+
+from celery import Celery
+from celery.signals import after_setup_logger
+
+from app.config import CELERY_ACKS_LATE, CELERY_BROKER_POOL_LIMIT, CELERY_BROKER_URL, CELERY_PREFETCH_MULTIPLIER, \
+    CELERY_RESULT_BACKEND, CELERY_RESULT_EXPIRES, NOTIFY_QUEUE
+from app.log_save import logger as log_setup
+
+# The one Celery app. Notification tasks go to NOTIFY_QUEUE, Celery's default
+# queue unless set; with NOTIFY_QUEUE=notifications a worker for them runs as:
+#   celery -A app.celery_app worker -Q notifications -P threads -c 100
+celery = Celery("app", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, include=["app.log_save.celery_tasks"])
+celery.conf.update(
+    worker_prefetch_multiplier=CELERY_PREFETCH_MULTIPLIER,
+    task_acks_late=CELERY_ACKS_LATE,
+    # with late acks, a task whose worker died is redelivered instead of lost
+    task_reject_on_worker_lost=CELERY_ACKS_LATE,
+    result_expires=CELERY_RESULT_EXPIRES,
+    broker_pool_limit=CELERY_BROKER_POOL_LIMIT,
+    task_routes={"app.log_save.celery_tasks.*": {"queue": NOTIFY_QUEUE}},
+)
+
+
+@after_setup_logger.connect
+def setup_celery_logger(logger, *args, **kwargs):
+    # the root logger is the only writer of logs/app.log; this also creates logs/
+    log_setup.configure()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("tasks")
+    fh = logging.FileHandler('logs/celery_tasks.log')
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
@@ -9,3 +9,72 @@ DB_HOST = os.environ.get('DB_HOST')
 DB_PORT = os.environ.get('DB_PORT')
 DB_NAME = os.environ.get('DB_NAME')
 JWT_KEY = os.environ.get('JWT_KEY')
+DB_ASYNC = os.environ.get('DB_ASYNC', 'false').lower() == 'true'
+
+HASH_POOL_KIND = os.environ.get('HASH_POOL_KIND', 'thread')
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', os.cpu_count() or 1))
+HASH_POOL_QUEUE_SIZE = int(os.environ.get('HASH_POOL_QUEUE_SIZE', 64))
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_LOCAL_TTL = float(os.environ.get('USER_CACHE_LOCAL_TTL', 5))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+TOKEN_CACHE_EXPIRY_MARGIN = int(os.environ.get('TOKEN_CACHE_EXPIRY_MARGIN', 60))
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
+DB_REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', 2))
+
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 256))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 0.5))
+LOG_OVERFLOW_POLICY = os.environ.get('LOG_OVERFLOW_POLICY', 'drop_new')
+
+LOG_ACCESS_SAMPLE_RATE = float(os.environ.get('LOG_ACCESS_SAMPLE_RATE', 1.0))
+LOG_ACCESS_SLOW_MS = float(os.environ.get('LOG_ACCESS_SLOW_MS', 1000))
+
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+SQL_PROFILE = os.environ.get('SQL_PROFILE', 'false').lower() == 'true'
+SQL_PROFILE_MAX_QUERIES = int(os.environ.get('SQL_PROFILE_MAX_QUERIES', 10))
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+
+NOTIFY_PROVIDER = os.environ.get('NOTIFY_PROVIDER', 'fake')
+# per-provider in-flight limits, e.g. "fake=200,http=50"
+NOTIFY_PROVIDER_CONCURRENCY = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition('=') for item in os.environ.get('NOTIFY_PROVIDER_CONCURRENCY', '').split(','))
+    if limit
+}
+NOTIFY_TIMEOUT = float(os.environ.get('NOTIFY_TIMEOUT', 10))
+NOTIFY_HTTP_URL = os.environ.get('NOTIFY_HTTP_URL', '')
+NOTIFY_FAKE_LATENCY = float(os.environ.get('NOTIFY_FAKE_LATENCY', 0.05))
+NOTIFY_FAKE_FAILURE_RATE = float(os.environ.get('NOTIFY_FAKE_FAILURE_RATE', 0))
+PUSH_BATCH_SIZE = int(os.environ.get('PUSH_BATCH_SIZE', 100))
+PUSH_BATCH_WINDOW = float(os.environ.get('PUSH_BATCH_WINDOW', 0.05))
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+# Celery's default queue, which plain workers consume; a dedicated queue is opt-in
+NOTIFY_QUEUE = os.environ.get('NOTIFY_QUEUE', 'celery')
+NOTIFY_MAX_RETRIES = int(os.environ.get('NOTIFY_MAX_RETRIES', 5))
+NOTIFY_RETRY_BASE = float(os.environ.get('NOTIFY_RETRY_BASE', 1))
+NOTIFY_RETRY_MAX_DELAY = float(os.environ.get('NOTIFY_RETRY_MAX_DELAY', 300))
+NOTIFY_BREAKER_FAILURES = int(os.environ.get('NOTIFY_BREAKER_FAILURES', 5))
+NOTIFY_BREAKER_RESET = float(os.environ.get('NOTIFY_BREAKER_RESET', 30))
+
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL)
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', REDIS_URL)
+CELERY_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 4))
+CELERY_ACKS_LATE = os.environ.get('CELERY_ACKS_LATE', 'false').lower() == 'true'
+CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))
+CELERY_BROKER_POOL_LIMIT = int(os.environ.get('CELERY_BROKER_POOL_LIMIT', 10))
@@ -1,55 +1,80 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import asc, desc
+from sqlalchemy import Integer, column, func, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert
 
-from app import models, schemas
-from app.auth import get_password_hash
+from app import models, schemas, sorting
 
 
-def get_profile(db: Session, first_name: str, last_name: str):
-    return db.query(models.User).filter(
+PROFILE_COLUMNS = [getattr(models.User, name) for name in schemas.User.model_fields]
+
+
+def profile_query(first_name: str, last_name: str):
+    return select(*PROFILE_COLUMNS).filter(
         models.User.first_name == first_name,
         models.User.last_name == last_name,
-        ).first()
+    ).limit(1)
+
+
+def get_profile(db: Session, first_name: str, last_name: str):
+    return db.execute(profile_query(first_name, last_name)).mappings().first()
 
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    db_user = models.User(
+# Writes return what the caller needs through RETURNING instead of refreshing
+# the ORM object afterwards, so each is a single round trip.
+def create_user_query(user: schemas.UserCreate, hashed_password: str):
+    return insert(models.User).values(
         email=user.email,
         username=user.username,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=hashed_password,
         first_name=user.first_name,
         last_name=user.last_name,
         balance=user.balance,
-    )
-    db.add(db_user)
+    ).on_conflict_do_nothing(index_elements=["email"]).returning(*PROFILE_COLUMNS)
+
+
+# None when the email was registered concurrently
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    created = db.execute(create_user_query(user, hashed_password)).mappings().first()
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return created
+
+
+# Bulk import: rows conflicting with an existing email or username are skipped;
+# returns how many were inserted.
+def import_users_query():
+    return insert(models.User).on_conflict_do_nothing().returning(models.User.id)
+
+
+def import_users(db: Session, rows: list[dict]):
+    inserted = len(db.execute(import_users_query(), rows).all())
+    db.commit()
+    return inserted
 
 
-def update_user_password(db: Session, db_user: schemas.User, new_password: str):
-    db_user.hashed_password = get_password_hash(new_password)
+def update_user_password(db: Session, db_user: schemas.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
-def get_users(
-        db: Session,
+STREAM_BATCH_SIZE = 1000
+
+
+def users_query(
         skip: int = 0,
         limit: int = 100,
         user_id: int = None,
         first_name: str = None,
         last_name: str = None,
-        sort_by: str = "id",
-        order: str = "asc"
+        sort: list[sorting.SortKey] = None,
+        cursor: list = None,
 ):
-    query = db.query(models.User)
+    query = select(models.User)
 
     if user_id is not None:
         query = query.filter(models.User.id == user_id)
@@ -58,12 +83,20 @@ def get_users(
     if last_name is not None:
         query = query.filter(models.User.last_name == last_name)
 
-    if order == "desc":
-        query = query.order_by(desc(getattr(models.User, sort_by, 'id')))
-    else:
-        query = query.order_by(asc(getattr(models.User, sort_by, 'id')))
+    sort = sort or sorting.parse_sort()
+    if cursor is not None:
+        query = query.filter(sorting.keyset_filter(sort, cursor))
+
+    return query.order_by(*sorting.order_by(sort)).offset(skip).limit(limit)
+
 
-    return query.offset(skip).limit(limit).all()
+def get_users(db: Session, **filters):
+    return db.scalars(users_query(**filters)).all()
+
+
+def stream_users(db: Session, **filters):
+    query = users_query(limit=None, **filters).execution_options(yield_per=STREAM_BATCH_SIZE)
+    return db.scalars(query).partitions()
 
 
 def get_user_by_name(db: Session, first_name: str, last_name: str):
@@ -73,18 +106,160 @@ def get_user_by_name(db: Session, first_name: str, last_name: str):
     ).first()
 
 
-def withdraw_balance(db: Session, user: schemas.User, amount: int):
-    if user.balance < amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-    user.balance -= amount
+def user_id_by_name(first_name: str, last_name: str):
+    return select(models.User.id).filter(
+        models.User.first_name == first_name,
+        models.User.last_name == last_name
+    ).order_by(models.User.id).limit(1)
+
+
+def withdraw_query(first_name: str, last_name: str, amount: int):
+    return update(models.User).where(
+        models.User.id == user_id_by_name(first_name, last_name).scalar_subquery(),
+        models.User.balance >= amount,
+    ).values(
+        balance=models.User.balance - amount
+    ).returning(
+        models.User.id, models.User.username, models.User.balance
+    ).execution_options(synchronize_session=False)
+
+
+def balance_operation_query(idempotency_key: str):
+    return select(models.BalanceOperation).filter(models.BalanceOperation.idempotency_key == idempotency_key)
+
+
+def record_balance_operation_query(idempotency_key: str, user_id: int, amount: int, new_balance: int):
+    return insert(models.BalanceOperation).values(
+        idempotency_key=idempotency_key,
+        user_id=user_id,
+        amount=amount,
+        new_balance=new_balance,
+    ).on_conflict_do_nothing(index_elements=["idempotency_key"]).returning(models.BalanceOperation.id)
+
+
+def replayed_balance(operation: models.BalanceOperation, user_id: int, amount: int):
+    if operation.user_id != user_id or operation.amount != amount:
+        raise HTTPException(status_code=422, detail="Idempotency key already used for a different operation")
+    return operation.new_balance
+
+
+def withdraw_error(user_exists: bool):
+    if not user_exists:
+        return HTTPException(status_code=404, detail="User not found")
+    return HTTPException(status_code=400, detail="Insufficient funds")
+
+
+def withdraw_balance(db: Session, first_name: str, last_name: str, amount: int, idempotency_key: str = None):
+    if idempotency_key is not None:
+        operation = db.scalars(balance_operation_query(idempotency_key)).first()
+        if operation is not None:
+            return replayed_balance(operation, db.scalar(user_id_by_name(first_name, last_name)), amount), None
+
+    row = db.execute(withdraw_query(first_name, last_name, amount)).first()
+    if row is None:
+        db.rollback()
+        raise withdraw_error(db.scalar(user_id_by_name(first_name, last_name)) is not None)
+
+    if idempotency_key is not None:
+        recorded = db.execute(record_balance_operation_query(idempotency_key, row.id, amount, row.balance)).first()
+        if recorded is None:
+            # a concurrent request with the same key committed first
+            db.rollback()
+            operation = db.scalars(balance_operation_query(idempotency_key)).one()
+            return replayed_balance(operation, row.id, amount), None
+
+    db.commit()
+    return row.balance, row.username
+
+
+BATCH_CHUNK_SIZE = 5000
+
+
+def batch_names(operations: list[schemas.BalanceOperation]):
+    return list(dict.fromkeys((operation.first_name, operation.last_name) for operation in operations))
+
+
+def batch_user_ids_query(names: list[tuple[str, str]]):
+    return select(
+        models.User.first_name, models.User.last_name, func.min(models.User.id)
+    ).filter(
+        tuple_(models.User.first_name, models.User.last_name).in_(names)
+    ).group_by(models.User.first_name, models.User.last_name)
+
+
+# Locks in id order, so concurrent batches can't deadlock on each other's rows
+def batch_lock_query(user_ids: list[int]):
+    return select(models.User.id, models.User.balance).filter(
+        models.User.id.in_(user_ids)
+    ).order_by(models.User.id).with_for_update()
+
+
+def batch_withdraw_query(amounts: list[tuple[int, int]]):
+    ops = values(column("id", Integer), column("amount", Integer), name="ops").data(amounts)
+    return update(models.User).where(
+        models.User.id == ops.c.id,
+        models.User.balance >= ops.c.amount,
+    ).values(
+        balance=models.User.balance - ops.c.amount
+    ).returning(
+        models.User.id, models.User.username, models.User.balance
+    ).execution_options(synchronize_session=False)
+
+
+def batch_chunks(items: list):
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        yield items[start:start + BATCH_CHUNK_SIZE]
+
+
+# Items are accepted in request order against each user's running balance, so
+# an item fails only if it doesn't fit after the earlier accepted ones. Returns
+# the per-item results and the accepted total per user id, ordered by id.
+def batch_results(operations, user_ids, balances):
+    remaining = dict(balances)
+    accepted = {}
+    results = []
+    for operation in operations:
+        user_id = user_ids.get((operation.first_name, operation.last_name))
+        if user_id is None:
+            results.append(schemas.BalanceOperationResult(
+                **operation.model_dump(), success=False, detail="User not found"))
+        elif (remaining[user_id] or 0) < operation.amount:
+            results.append(schemas.BalanceOperationResult(
+                **operation.model_dump(), success=False, detail="Insufficient funds"))
+        else:
+            remaining[user_id] -= operation.amount
+            accepted[user_id] = accepted.get(user_id, 0) + operation.amount
+            results.append(schemas.BalanceOperationResult(
+                **operation.model_dump(), success=True, new_balance=remaining[user_id]))
+    return results, sorted(accepted.items())
+
+
+def withdraw_balance_batch(db: Session, operations: list[schemas.BalanceOperation]):
+    user_ids = {}
+    for names in batch_chunks(batch_names(operations)):
+        user_ids.update({(first, last): user_id for first, last, user_id in db.execute(batch_user_ids_query(names))})
+    balances = {}
+    for ids in batch_chunks(sorted(user_ids.values())):
+        balances.update(db.execute(batch_lock_query(ids)).all())
+    results, accepted = batch_results(operations, user_ids, balances)
+    usernames = []
+    for amounts in batch_chunks(accepted):
+        usernames.extend(username for _, username, _ in db.execute(batch_withdraw_query(amounts)))
     db.commit()
-    db.refresh(user)
-    return user
+    return results, usernames
+
+
+def update_profile_query(first_name: str, last_name: str, new_first_name: str, new_last_name: str):
+    return update(models.User).where(
+        models.User.id == user_id_by_name(first_name, last_name).scalar_subquery(),
+    ).values(
+        first_name=new_first_name,
+        last_name=new_last_name,
+    ).returning(models.User.id, models.User.username).execution_options(synchronize_session=False)
 
 
-def update_user_profile(db: Session, user: schemas.User, new_first_name: str, new_last_name: str):
-    user.first_name = new_first_name
-    user.last_name = new_last_name
+# None when no user has that name
+def update_user_profile(db: Session, first_name: str, last_name: str, new_first_name: str, new_last_name: str):
+    row = db.execute(update_profile_query(first_name, last_name, new_first_name, new_last_name)).first()
     db.commit()
-    db.refresh(user)
-    return user
+    return row
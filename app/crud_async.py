@@ -0,0 +1,116 @@
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud, models, schemas
+from app.database import async_variant
+
+
+@async_variant(crud.get_profile)
+async def get_profile(db: AsyncSession, first_name: str, last_name: str):
+    result = await db.execute(crud.profile_query(first_name, last_name))
+    return result.mappings().first()
+
+
+@async_variant(crud.get_user_by_email)
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+
+@async_variant(crud.create_user)
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    created = (await db.execute(crud.create_user_query(user, hashed_password))).mappings().first()
+    await db.commit()
+    return created
+
+
+@async_variant(crud.import_users)
+async def import_users(db: AsyncSession, rows: list[dict]):
+    inserted = len((await db.execute(crud.import_users_query(), rows)).all())
+    await db.commit()
+    return inserted
+
+
+@async_variant(crud.update_user_password)
+async def update_user_password(db: AsyncSession, db_user: schemas.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    await db.commit()
+    return db_user
+
+
+@async_variant(crud.get_users)
+async def get_users(db: AsyncSession, **filters):
+    result = await db.execute(crud.users_query(**filters))
+    return result.scalars().all()
+
+
+async def stream_users(session_factory, **filters):
+    if isinstance(session_factory, async_sessionmaker):
+        async with session_factory() as db:
+            query = crud.users_query(limit=None, **filters).execution_options(yield_per=crud.STREAM_BATCH_SIZE)
+            async for partition in (await db.stream_scalars(query)).partitions():
+                yield partition
+    else:
+        with session_factory() as db:
+            partitions = await run_in_threadpool(crud.stream_users, db, **filters)
+            async for partition in iterate_in_threadpool(partitions):
+                yield partition
+
+
+@async_variant(crud.get_user_by_name)
+async def get_user_by_name(db: AsyncSession, first_name: str, last_name: str):
+    result = await db.execute(select(models.User).filter(
+        models.User.first_name == first_name,
+        models.User.last_name == last_name
+    ))
+    return result.scalars().first()
+
+
+@async_variant(crud.withdraw_balance)
+async def withdraw_balance(db: AsyncSession, first_name: str, last_name: str, amount: int, idempotency_key: str = None):
+    if idempotency_key is not None:
+        operation = (await db.scalars(crud.balance_operation_query(idempotency_key))).first()
+        if operation is not None:
+            user_id = await db.scalar(crud.user_id_by_name(first_name, last_name))
+            return crud.replayed_balance(operation, user_id, amount), None
+
+    row = (await db.execute(crud.withdraw_query(first_name, last_name, amount))).first()
+    if row is None:
+        await db.rollback()
+        raise crud.withdraw_error(await db.scalar(crud.user_id_by_name(first_name, last_name)) is not None)
+
+    if idempotency_key is not None:
+        query = crud.record_balance_operation_query(idempotency_key, row.id, amount, row.balance)
+        if (await db.execute(query)).first() is None:
+            await db.rollback()
+            operation = (await db.scalars(crud.balance_operation_query(idempotency_key))).one()
+            return crud.replayed_balance(operation, row.id, amount), None
+
+    await db.commit()
+    return row.balance, row.username
+
+
+@async_variant(crud.withdraw_balance_batch)
+async def withdraw_balance_batch(db: AsyncSession, operations: list[schemas.BalanceOperation]):
+    user_ids = {}
+    for names in crud.batch_chunks(crud.batch_names(operations)):
+        result = await db.execute(crud.batch_user_ids_query(names))
+        user_ids.update({(first, last): user_id for first, last, user_id in result})
+    balances = {}
+    for ids in crud.batch_chunks(sorted(user_ids.values())):
+        balances.update((await db.execute(crud.batch_lock_query(ids))).all())
+    results, accepted = crud.batch_results(operations, user_ids, balances)
+    usernames = []
+    for amounts in crud.batch_chunks(accepted):
+        usernames.extend(username for _, username, _ in await db.execute(crud.batch_withdraw_query(amounts)))
+    await db.commit()
+    return results, usernames
+
+
+@async_variant(crud.update_user_profile)
+async def update_user_profile(db: AsyncSession, first_name: str, last_name: str, new_first_name: str, new_last_name: str):
+    query = crud.update_profile_query(first_name, last_name, new_first_name, new_last_name)
+    row = (await db.execute(query)).first()
+    await db.commit()
+    return row
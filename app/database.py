@@ -1,21 +1,186 @@
+import threading
+from functools import wraps
+from types import SimpleNamespace
+
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from app.config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from app import pool_stats
+from app.config import DB_ASYNC, DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, \
+    DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_CONNECT_TIMEOUT, \
+    DB_REPLICA_HOSTS, DB_REPLICA_MAX_LAG
+from app.replicas import ReplicaRouter
+
+
+def database_url(host, port):
+    return f"postgresql://{DB_USER}:{DB_PASS}@{host}:{port}/{DB_NAME}?sslmode=disable"
+
+
+def async_database_url(host, port):
+    return f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{host}:{port}/{DB_NAME}?ssl=disable"
+
+
+SQLALCHEMY_DATABASE_URL = database_url(DB_HOST, DB_PORT)
+SQLALCHEMY_ASYNC_DATABASE_URL = async_database_url(DB_HOST, DB_PORT)
+REPLICA_ADDRESSES = [(host, port or DB_PORT) for host, _, port in (replica.partition(":") for replica in DB_REPLICA_HOSTS)]
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# Engines, pools and the replica router are built on first use (normally the
+# app lifespan), so importing the app opens no pools and each forked worker
+# builds its own.
+RESOURCES = ("engine", "SessionLocal", "async_engine", "AsyncSessionLocal", "replicas")
+
+_lock = threading.Lock()
+_resources = None
+
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=disable"
+def create_resources():
+    engine = pool_stats.register(create_engine(
+        SQLALCHEMY_DATABASE_URL, poolclass=pool_stats.TimedQueuePool, pool_logging_name="primary", **POOL_OPTIONS
+    ))
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+    if DB_ASYNC:
+        async_engine = pool_stats.register(create_async_engine(
+            SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=pool_stats.TimedAsyncAdaptedQueuePool, pool_logging_name="async",
+            **POOL_OPTIONS
+        ))
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        replica_session_factories = [
+            async_sessionmaker(pool_stats.register(create_async_engine(
+                url, poolclass=pool_stats.TimedAsyncAdaptedQueuePool, pool_logging_name=f"async_replica{i}",
+                connect_args={"timeout": DB_REPLICA_CONNECT_TIMEOUT}, **POOL_OPTIONS
+            )), autoflush=False, expire_on_commit=False)
+            for i, url in enumerate(async_database_url(host, port) for host, port in REPLICA_ADDRESSES)
+        ]
+    else:
+        async_engine = None
+        AsyncSessionLocal = None
+        replica_session_factories = [
+            sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=pool_stats.register(create_engine(
+                url, poolclass=pool_stats.TimedQueuePool, pool_logging_name=f"replica{i}",
+                connect_args={"connect_timeout": DB_REPLICA_CONNECT_TIMEOUT}, **POOL_OPTIONS
+            )))
+            for i, url in enumerate(database_url(host, port) for host, port in REPLICA_ADDRESSES)
+        ]
+    replicas = ReplicaRouter(replica_session_factories, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL)
+    return SimpleNamespace(
+        engine=engine, SessionLocal=SessionLocal, async_engine=async_engine, AsyncSessionLocal=AsyncSessionLocal,
+        replicas=replicas,
+    )
+
+
+def resources():
+    global _resources
+    if _resources is None:
+        with _lock:
+            if _resources is None:
+                _resources = create_resources()
+    return _resources
+
+
+async def dispose():
+    global _resources
+    with _lock:
+        current, _resources = _resources, None
+    if current is None:
+        return
+    current.engine.dispose()
+    if current.async_engine is not None:
+        await current.async_engine.dispose()
+    for factory in current.replicas.session_factories:
+        bind = factory.kw["bind"]
+        if isinstance(bind, AsyncEngine):
+            await bind.dispose()
+        else:
+            bind.dispose()
+
+
+# keeps `database.engine`, `database.SessionLocal`, ... working
+def __getattr__(name):
+    if name in RESOURCES:
+        return getattr(resources(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
 # Dependency
 def get_db():
-    db = SessionLocal()
+    db = resources().SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with resources().AsyncSessionLocal() as db:
+        yield db
+
+
+get_session = get_async_db if DB_ASYNC else get_db
+
+
+# Streaming responses outlive request-scoped sessions and open their own
+def get_session_factory():
+    current = resources()
+    return current.AsyncSessionLocal if DB_ASYNC else current.SessionLocal
+
+
+# Read-only dependencies: a replica within DB_REPLICA_MAX_LAG, else the primary
+def get_read_db():
+    current = resources()
+    db = (current.replicas.pick() or current.SessionLocal)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    current = resources()
+    async with (await current.replicas.pick_async() or current.AsyncSessionLocal)() as db:
+        yield db
+
+
+def get_replica_session_factory():
+    current = resources()
+    return current.replicas.pick() or current.SessionLocal
+
+
+async def get_async_replica_session_factory():
+    current = resources()
+    return await current.replicas.pick_async() or current.AsyncSessionLocal
+
+
+if DB_REPLICA_HOSTS:
+    get_read_session = get_async_read_db if DB_ASYNC else get_read_db
+    get_read_session_factory = get_async_replica_session_factory if DB_ASYNC else get_replica_session_factory
+else:
+    get_read_session = get_session
+    get_read_session_factory = get_session_factory
+
+
+# Runs the decorated coroutine for an AsyncSession, or `sync_func` in the
+# threadpool for a plain Session, so callers can always await it.
+def async_variant(sync_func):
+    def decorator(async_func):
+        @wraps(async_func)
+        async def wrapper(db, *args, **kwargs):
+            if isinstance(db, AsyncSession):
+                return await async_func(db, *args, **kwargs)
+            return await run_in_threadpool(sync_func, db, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,35 @@
+import time
+from collections import defaultdict
+
+from app.metrics import Histogram
+
+# keyed by route template rather than raw path to keep label cardinality bounded
+requests = defaultdict(int)
+request_seconds = defaultdict(Histogram)
+
+
+class HttpStatsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            requests[(scope["method"], route, status_code)] += 1
+            request_seconds[(scope["method"], route)].observe(time.perf_counter() - start)
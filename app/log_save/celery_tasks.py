@@ -1,15 +1,51 @@
-import time
-from celery import shared_task
+import random
+
 from celery.utils.log import get_task_logger
 
+from app.celery_app import celery
+from app.config import NOTIFY_MAX_RETRIES, NOTIFY_PROVIDER, NOTIFY_RETRY_BASE, NOTIFY_RETRY_MAX_DELAY
+from app.notifications import dead_letter
+from app.notifications.dispatcher import get_dispatcher
+
 logger = get_task_logger("tasks")
 
+DEFAULT_MESSAGE = {"title": "Notification"}
+
+
+# exponential backoff with full jitter, so retries after an outage spread out
+def retry_delay(retries: int):
+    return random.uniform(0, min(NOTIFY_RETRY_MAX_DELAY, NOTIFY_RETRY_BASE * 2 ** retries))
+
 
-@shared_task
-def send_notification(device_token: str):
+# Delivers what it can and retries only the failed tokens; once the retry
+# budget is spent they go to the dead-letter list for a later replay.
+def deliver(task, device_tokens: list[str], message: dict, retry_args):
+    results = get_dispatcher().send_many(NOTIFY_PROVIDER, device_tokens, message or DEFAULT_MESSAGE)
+    failed = [(device_token, result) for device_token, result in zip(device_tokens, results) if isinstance(result, Exception)]
+    dead_letter.record("delivered", len(device_tokens) - len(failed))
+    if not failed:
+        return
+    dead_letter.record("failed", len(failed))
+    error = str(failed[0][1])
+    failed_tokens = [device_token for device_token, _ in failed]
+    logger.error(f"push delivery failed for {len(failed)} of {len(device_tokens)} tokens: {error}")
+    if task.request.retries < task.max_retries:
+        dead_letter.record("retried", len(failed))
+        raise task.retry(args=retry_args(failed_tokens), countdown=retry_delay(task.request.retries))
+    dead_letter.push(failed_tokens, message, error, task.request.retries + 1)
+    dead_letter.record("dead_lettered", len(failed))
+
+
+# Delivery runs on the worker's shared dispatcher loop, so with a threads or
+# gevent pool many tasks push concurrently within the provider limit.
+# Pushes are fire-and-forget: nothing reads their results, so none are stored.
+@celery.task(bind=True, ignore_result=True, max_retries=NOTIFY_MAX_RETRIES)
+def send_notification(self, device_token: str, message: dict = None):
     logger.info("starting background task")
-    time.sleep(10)  # simulates slow network call to firebase/sns
-    try:
-        a=11/0  #critical part that may fail, and its analysis is important
-    except Exception as e:
-        logger.error(f"exception while division {e}")
\ No newline at end of file
+    deliver(self, [device_token], message, lambda failed_tokens: (failed_tokens[0], message))
+
+
+@celery.task(bind=True, ignore_result=True, max_retries=NOTIFY_MAX_RETRIES)
+def send_notifications(self, device_tokens: list[str], message: dict = None):
+    logger.info(f"sending {len(device_tokens)} notifications")
+    deliver(self, device_tokens, message, lambda failed_tokens: (failed_tokens, message))
@@ -0,0 +1,11 @@
+from contextvars import ContextVar
+
+# One mutable dict per request, set by the access log middleware; code deeper in
+# the request (e.g. auth) adds to it and every log record picks it up.
+request_context: ContextVar[dict] = ContextVar("request_context", default={})
+
+
+def bind(**fields):
+    context = request_context.get()
+    if context:
+        context.update(fields)
@@ -1,15 +1,76 @@
-from starlette.middleware.base import BaseHTTPMiddleware
+import time
+import uuid
+import random
+import logging
+
+from app.config import LOG_ACCESS_SAMPLE_RATE, LOG_ACCESS_SLOW_MS
+from app.log_save.context import request_context
 from app.log_save.logger import logger
 
+MAX_REQUEST_ID_LENGTH = 128
+
+
+def request_id(scope):
+    for name, value in scope["headers"]:
+        if name == b"x-request-id" and value:
+            return value[:MAX_REQUEST_ID_LENGTH].decode("latin-1")
+    return uuid.uuid4().hex
+
+
+# Plain ASGI middleware: wraps `send` instead of buffering the response, so
+# streaming bodies pass through untouched. Latency runs until the app has sent
+# its last body chunk. Successful fast requests are logged at `sample_rate`;
+# errors and slow requests always are.
+class LogMiddleware:
+    def __init__(self, app, sample_rate=LOG_ACCESS_SAMPLE_RATE, slow_ms=LOG_ACCESS_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        context = {"request_id": request_id(scope)}
+        request_context.set(context)
+        response = {"status_code": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", context["request_id"].encode("latin-1"))]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.log(scope, response, (time.perf_counter() - start) * 1000)
 
-class LogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        logger.info(
+    def log(self, scope, response, latency_ms):
+        status_code = response["status_code"]
+        if status_code >= 500:
+            level = logging.ERROR
+        elif status_code >= 400:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+            if latency_ms < self.slow_ms and self.sample_rate < 1 and random.random() >= self.sample_rate:
+                return
+        if not logger.isEnabledFor(level):
+            return
+        path = scope["path"]
+        if scope["query_string"]:
+            path = f"{path}?{scope['query_string'].decode('latin-1')}"
+        logger.log(
+            level,
             "Incoming request",
             extra={
-                "req": { "method": request.method, "url": str(request.url) },
-                "res": { "status_code": response.status_code, },
+                "req": {"method": scope["method"], "url": path},
+                "res": {"status_code": status_code, "size": response["size"]},
+                "latency_ms": round(latency_ms, 3),
             },
         )
-        return response
\ No newline at end of file
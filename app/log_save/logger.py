@@ -1,37 +1,240 @@
 import os
+import copy
 import json
+import time
+import queue
+import atexit
 import logging
 from logging import Formatter
+from logging.handlers import QueueHandler, QueueListener
 
+from app.config import LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_OVERFLOW_POLICY, LOG_QUEUE_SIZE
+from app.log_save.context import request_context
 from app.log_save.level_log import logging_level
 
-if not os.path.exists('logs'):
-   os.makedirs('logs')
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+json_dumps = json.JSONEncoder(default=str, separators=(",", ":")).encode
+
+
+def orjson_dumps(value):
+    return orjson.dumps(value, default=str).decode()
+
+
+dumps = orjson_dumps if orjson is not None else json_dumps
+
+CONTEXT_FIELDS = ("request_id", "user_id", "latency_ms", "req", "res", "sql")
+
+
+# Static parts of each line (level, logger) are encoded once per level/logger
+# pair and the timestamp once per second; the per-record values go through
+# the encoder in a single call.
 class JsonFormatter(Formatter):
     def __init__(self):
         super(JsonFormatter, self).__init__()
+        self._prefixes = {}
+        self._second = None
+        self._second_text = ""
+
+    def timestamp(self, created):
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1000):03d}Z"
 
     def format(self, record):
-        json_record = {}
-        json_record["message"] = record.getMessage()
-        if "req" in record.__dict__:
-            json_record["req"] = record.__dict__["req"]
-        if "res" in record.__dict__:
-            json_record["res"] = record.__dict__["res"]
-        if record.levelno == logging.ERROR and record.exc_info:
-            json_record["err"] = self.formatException(record.exc_info)
-        return json.dumps(json_record)
+        prefix = self._prefixes.get((record.levelno, record.name))
+        if prefix is None:
+            prefix = self._prefixes[(record.levelno, record.name)] = (
+                f'{{"level":{dumps(record.levelname)},"logger":{dumps(record.name)},"timestamp":"'
+            )
+        values = {"message": record.getMessage()}
+        fields = record.__dict__
+        for field in CONTEXT_FIELDS:
+            value = fields.get(field)
+            if value is not None:
+                values[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            values["err"] = record.exc_text
+        return f'{prefix}{self.timestamp(record.created)}",{dumps(values)[1:]}'
+
+
+class RequestContextFilter(logging.Filter):
+    # runs on the caller's thread, where the request's context is visible
+    def filter(self, record):
+        for field, value in request_context.get().items():
+            if field not in record.__dict__:
+                setattr(record, field, value)
+        return True
+
+
+# Never blocks the caller: when the queue is full the record is dropped
+# ("drop_new") or the oldest queued record makes room for it ("drop_oldest").
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue, policy="drop_new"):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.stats = {"enqueued": 0, "dropped": 0}
+
+    def prepare(self, record):
+        # like QueueHandler.prepare, but keeps the traceback apart from the message
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            if self.policy != "drop_oldest":
+                return
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                return
+        self.stats["enqueued"] += 1
+
+
+class DeferredFlushMixin:
+    # emit() flushes after every record; the listener flushes once per batch instead
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        with self.lock:
+            try:
+                super().flush()
+            except (OSError, ValueError):
+                pass
+
+
+class DeferredStreamHandler(DeferredFlushMixin, logging.StreamHandler):
+    pass
 
 
+class DeferredFileHandler(DeferredFlushMixin, logging.FileHandler):
+    pass
+
+
+class BatchingQueueListener(QueueListener):
+    def __init__(self, log_queue, *handlers, batch_size=256, flush_interval=0.5, stop_timeout=5.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stop_timeout = stop_timeout
+        self.stats = {"batches": 0, "records": 0}
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush_batch()
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+    # The queue is likely full at exit under load, where put_nowait would raise
+    # and leave the thread running until it dies with the buffered records:
+    # wait for room, and if none frees up, drop the oldest record for it.
+    def enqueue_sentinel(self):
+        try:
+            self.queue.put(self._sentinel, timeout=self.stop_timeout)
+            return
+        except queue.Full:
+            pass
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            self.stats["batches"] += 1
+            self.stats["records"] += len(batch) - stop
+            self.flush()
+            if stop:
+                return
+
+
+# The listener thread does not survive fork (celery prefork, uvicorn workers):
+# hold the handler locks with buffers flushed across the fork so the child
+# inherits clean streams, then give the child its own queue (the inherited
+# one still holds the parent's pending records) and listener thread.
+def before_fork():
+    for handler in listener.handlers:
+        handler.acquire()
+        handler.flush_batch()
+
+
+def after_fork_in_parent():
+    for handler in listener.handlers:
+        handler.release()
+
+
+def after_fork_in_child():
+    listener.queue = queue_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener._thread = None
+    listener.start()
+
 
 logger = logging.getLogger()
-logger.setLevel(logging_level)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(JsonFormatter())
-file_handler = logging.FileHandler('logs/app.log')
-file_handler.setFormatter(JsonFormatter())
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-logging.getLogger("uvicorn.access").disabled = True
+
+# Created by configure(), so importing this module opens no files and starts
+# no threads; processes that log (app startup, Celery workers, CLIs) call it.
+log_queue = queue_handler = console_handler = file_handler = listener = None
+
+
+def configure():
+    global log_queue, queue_handler, console_handler, file_handler, listener
+    if listener is not None:
+        return listener
+    os.makedirs('logs', exist_ok=True)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue, policy=LOG_OVERFLOW_POLICY)
+    queue_handler.addFilter(RequestContextFilter())
+
+    console_handler = DeferredStreamHandler()
+    console_handler.setFormatter(JsonFormatter())
+    file_handler = DeferredFileHandler('logs/app.log')
+    file_handler.setFormatter(JsonFormatter())
+    listener = BatchingQueueListener(
+        log_queue, console_handler, file_handler, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL
+    )
+
+    logger.setLevel(logging_level)
+    logger.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(before=before_fork, after_in_parent=after_fork_in_parent, after_in_child=after_fork_in_child)
+
+    logging.getLogger("uvicorn.access").disabled = True
+    return listener
@@ -1,44 +1,80 @@
-import asyncio
-import uvloop
-import uvicorn
+import logging
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from typing import Annotated
-from fastapi import FastAPI, Depends, HTTPException, status
+from typing import Annotated, Literal, Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 
-from app import crud, schemas
-from app.auth import verify_password, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, \
-    authenticate_user, get_current_active_user
-from app.log_save.celery_logger import logger
-from app.log_save.celery_tasks import send_notification
+from app import bulk_import, crud_async, database, pool_stats, schemas, sorting, telemetry, user_cache
+from app.auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, \
+    authenticate_user_async, get_current_active_user
+from app.log_save import logger as log_setup
+from app.notifications.batcher import push_batcher
 from app.schemas import UserChangePassword, UserChangeName, Token, UserAuth
-from app.database import get_db
-from app.cache_token import get_token, set_token
+from app.database import get_read_session, get_read_session_factory, get_session, get_session_factory
+from app.hashing import get_password_hash_async, verify_password_async
+from app.cache_token import get_token, invalidate_token, set_token
 from app.log_save.log_middlware import LogMiddleware
+from app.http_stats import HttpStatsMiddleware
+from app.config import SQL_PROFILE
+from app.sql_profiler import SqlProfileMiddleware
 
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing is opened at import time: logging, the database pools and the
+    # metrics writer start here, the caches and Celery on first use.
+    log_setup.configure()
+    database.resources()
+    if telemetry.snapshot_writer is not None:
+        telemetry.snapshot_writer.start()
+    yield
+    await push_batcher.close()
+    if telemetry.snapshot_writer is not None:
+        telemetry.snapshot_writer.stop()
+    await database.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(LogMiddleware)
+app.add_middleware(HttpStatsMiddleware)
+if SQL_PROFILE:
+    app.add_middleware(SqlProfileMiddleware)
 
 @app.get("/push/{device_token}")
 async def notify(device_token: str):
     logger.info("Sending notification in background")
-    send_notification.delay(device_token)
+    await push_batcher.add(device_token)
     return {"message": "Notification sent"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    # sync so the threadpool absorbs the Redis round trips
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/db_pool")
+async def db_pool_metrics():
+    return pool_stats.snapshot()
+
+
 @app.post("/token")
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ) -> Token:
-    stored_token = await get_token(form_data.username)
+    stored_token = await get_token(form_data.username, form_data.password)
     if stored_token:
         logger.info("Returning stored token for user: %s", form_data.username)
         return Token(access_token=stored_token, token_type="bearer")
 
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         logger.error("Failed login attempt for user: %s", form_data.username)
         raise HTTPException(
@@ -50,7 +86,7 @@ async def login_for_access_token(
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
-    await set_token(user.username, access_token, ttl=ACCESS_TOKEN_EXPIRE_MINUTES)
+    await set_token(user.username, form_data.password, access_token)
     logger.info("User %s logged in successfully, token created", user.username)
     return Token(access_token=access_token, token_type="bearer")
 
@@ -72,19 +108,42 @@ async def read_own_items(
 
 
 @app.post('/register', response_model=schemas.User)
-async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: Session = Depends(get_session)):
     logger.info("Registering new user with email: %s", user.email)
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud_async.get_user_by_email(db, email=user.email)
     if db_user:
         logger.error("Registration failed: Email already registered for %s", user.email)
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await get_password_hash_async(user.password)
+    created = await crud_async.create_user(db=db, user=user, hashed_password=hashed_password)
+    if created is None:
+        logger.error("Registration failed: Email already registered for %s", user.email)
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return created
+
+
+# The body is read as a stream, one record per line, and progress is logged
+# after every committed batch. After an interrupted import, resend with
+# resume_from set to the last logged "processed" count.
+@app.post('/users/import')
+async def import_users(
+    request: Request,
+    current_user: Annotated[UserAuth, Depends(get_current_active_user)],
+    format: Literal["csv", "ndjson"] = "csv",
+    resume_from: Annotated[int, Query(ge=0)] = 0,
+    session_factory=Depends(get_session_factory),
+):
+    logger.info("User %s importing users (%s) from record %d", current_user.username, format, resume_from)
+    records = bulk_import.parse_records(bulk_import.decode_lines(request.stream()), format)
+    async for progress in bulk_import.import_users(records, session_factory, start=resume_from):
+        logger.info("User import progress: %s", progress)
+    return progress
 
 
 @app.post('/login')
-async def login(user: schemas.UserBase, db: Session = Depends(get_db)):
+async def login(user: schemas.UserBase, db: Session = Depends(get_session)):
     logger.info("User login attempt with email: %s", user.email)
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud_async.get_user_by_email(db, email=user.email)
     if db_user:
         logger.info("User %s logged in successfully", user.email)
         return {"message": "You are now logged in"}
@@ -99,33 +158,66 @@ async def logout():
 
 
 @app.post('/change_password')
-async def change_password(user: UserChangePassword, db: Session = Depends(get_db)):
+async def change_password(user: UserChangePassword, db: Session = Depends(get_session)):
     logger.info("Changing password for user: %s", user.email)
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud_async.get_user_by_email(db, email=user.email)
     if not db_user:
         logger.error("Password change failed: User not found for email %s", user.email)
         raise HTTPException(status_code=404, detail='User not found')
-    if not verify_password(user.password, db_user.hashed_password):
+    if not await verify_password_async(user.password, db_user.hashed_password):
         logger.error("Password change failed: Old password is incorrect for user %s", user.email)
         raise HTTPException(status_code=400, detail="Old password is incorrect")
     if user.new_password != user.confirm_new_password:
         logger.error("Password change failed: New passwords do not match for user %s", user.email)
         raise HTTPException(status_code=400, detail="New passwords do not match")
-    crud.update_user_password(db=db, db_user=db_user, new_password=user.new_password)
+    hashed_password = await get_password_hash_async(user.new_password)
+    await crud_async.update_user_password(db=db, db_user=db_user, hashed_password=hashed_password)
+    await user_cache.invalidate_user(db_user.username)
+    await invalidate_token(db_user.username, user.password)
     logger.info("Password changed successfully for user: %s", user.email)
     return {"message": "Password changed successfully"}
 
 
-@app.get('/get_users')
-async def get_users(db: Session = Depends(get_db)):
+async def users_ndjson(session_factory, filters: dict):
+    async for users in crud_async.stream_users(session_factory, **filters):
+        yield "".join(schemas.UserListItem.model_validate(user).model_dump_json() + "\n" for user in users)
+
+
+@app.get('/get_users', response_model=list[schemas.UserListItem])
+async def get_users(
+    response: Response,
+    user_id: Optional[int] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+    sort_by: str = "id",
+    order: Literal["asc", "desc"] = "asc",
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    skip: Annotated[int, Query(ge=0)] = 0,
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    db: Session = Depends(get_read_session),
+    session_factory=Depends(get_read_session_factory),
+):
+    sort = sorting.parse_sort(sort_by, order)
+    sorting.check_sort_cost(sort, narrowed=user_id is not None or first_name is not None)
+    filters = {"user_id": user_id, "first_name": first_name, "last_name": last_name, "sort": sort}
+    if format == "ndjson":
+        logger.info("Streaming all users")
+        return StreamingResponse(users_ndjson(session_factory, filters), media_type="application/x-ndjson")
+
     logger.info("Getting all users")
-    return crud.get_users(db=db)
+    if cursor is not None:
+        filters["cursor"] = sorting.decode_cursor(cursor, sort)
+    users = await crud_async.get_users(db=db, skip=skip, limit=limit, **filters)
+    if len(users) == limit:
+        response.headers["X-Next-Cursor"] = sorting.encode_cursor(users[-1], sort)
+    return users
 
 
 @app.get("/balance")
-async def get_balance(first_name: str, last_name: str, db: Session = Depends(get_db)):
+async def get_balance(first_name: str, last_name: str, db: Session = Depends(get_read_session)):
     logger.info("Getting balance for user: %s %s", first_name, last_name)
-    user = crud.get_user_by_name(db, first_name, last_name)
+    user = await crud_async.get_user_by_name(db, first_name, last_name)
     if not user:
         logger.error("Balance get failed: User not found for %s %s", first_name, last_name)
         raise HTTPException(status_code=404, detail="User not found")
@@ -134,39 +226,67 @@ async def get_balance(first_name: str, last_name: str, db: Session = Depends(get
 
 
 @app.put("/withdraw_balance")
-async def withdraw_balance(first_name: str, last_name: str, amount: int, db: Session = Depends(get_db)):
+async def withdraw_balance(
+    first_name: str,
+    last_name: str,
+    amount: Annotated[int, Query(gt=0)],
+    idempotency_key: Annotated[Optional[str], Header()] = None,
+    db: Session = Depends(get_session),
+):
     logger.info("Withdraw balance attempt for user: %s %s, amount: %d", first_name, last_name, amount)
-    user = crud.get_user_by_name(db=db, first_name=first_name, last_name=last_name)
-    if not user:
-        logger.error("Withdrawal failed: User not found for %s %s", first_name, last_name)
-        raise HTTPException(status_code=404, detail="User not found")
-    crud.withdraw_balance(db=db, user=user, amount=amount)
-    logger.info("Withdrawal successful for user: %s %s, new balance: %s", first_name, last_name, user.balance)
-    return {"message": "Balance updated", "new_balance": user.balance}
+    try:
+        new_balance, username = await crud_async.withdraw_balance(
+            db=db, first_name=first_name, last_name=last_name, amount=amount, idempotency_key=idempotency_key
+        )
+    except HTTPException as e:
+        logger.error("Withdrawal failed for %s %s: %s", first_name, last_name, e.detail)
+        raise
+    await user_cache.invalidate_user(username)
+    logger.info("Withdrawal successful for user: %s %s, new balance: %s", first_name, last_name, new_balance)
+    return {"message": "Balance updated", "new_balance": new_balance}
+
+
+@app.post("/withdraw_balance/batch", response_model=list[schemas.BalanceOperationResult])
+async def withdraw_balance_batch(operations: list[schemas.BalanceOperation], db: Session = Depends(get_session)):
+    logger.info("Batch withdrawal of %d operations", len(operations))
+    results, usernames = await crud_async.withdraw_balance_batch(db=db, operations=operations)
+    await user_cache.invalidate_user(*usernames)
+    failed = sum(not result.success for result in results)
+    if failed:
+        logger.error("Batch withdrawal: %d of %d operations failed", failed, len(results))
+    return results
 
 
 @app.put("/update_profile")
-async def update_profile(user: UserChangeName, db: Session = Depends(get_db)):
+async def update_profile(user: UserChangeName, db: Session = Depends(get_session)):
     logger.info("Updating profile for user: %s %s", user.first_name, user.last_name)
-    db_user = crud.get_user_by_name(db=db, first_name=user.first_name, last_name=user.last_name)
-    if not db_user:
+    updated = await crud_async.update_user_profile(
+        db=db, first_name=user.first_name, last_name=user.last_name,
+        new_first_name=user.new_first_name, new_last_name=user.new_last_name,
+    )
+    if updated is None:
         logger.error("Profile update failed: User not found for %s %s", user.first_name, user.last_name)
         raise HTTPException(status_code=404, detail="User not found")
-    crud.update_user_profile(db=db, user=db_user, new_first_name=user.new_first_name, new_last_name=user.new_last_name)
+    await user_cache.invalidate_user(updated.username)
     logger.info("Profile updated successfully for user: %s %s", user.first_name, user.last_name)
     return {"message": "Profile updated", "first_name": user.first_name, "last_name": user.last_name}
 
 
-@app.get("/profile")
-async def get_profile(first_name: str, last_name: str, db: Session = Depends(get_db)):
+@app.get("/profile", response_model=schemas.User)
+async def get_profile(first_name: str, last_name: str, db: Session = Depends(get_read_session)):
     logger.info("Fetching profile for user: %s %s", first_name, last_name)
-    user = crud.get_user_by_name(db=db, first_name=first_name, last_name=last_name)
-    if not user:
+    profile = await crud_async.get_profile(db=db, first_name=first_name, last_name=last_name)
+    if not profile:
         logger.error("Profile fetch failed: User not found for %s %s", first_name, last_name)
         raise HTTPException(status_code=404, detail="User not found")
-    return crud.get_profile(db=db, first_name=first_name, last_name=last_name)
+    return profile
 
 
 if __name__ == '__main__':
+    import asyncio
+
+    import uvicorn
+    import uvloop
+
     asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
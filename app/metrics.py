@@ -0,0 +1,132 @@
+import os
+import json
+import bisect
+
+
+class Histogram:
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: tuple = None):
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+# One metric in the Prometheus text format: samples are keyed by
+# (sample name, label pairs) so families from several workers merge by summing.
+class Family:
+    def __init__(self, name: str, kind: str, help: str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples = {}
+
+    def add(self, value: float, suffix: str = "", **labels):
+        key = (self.name + suffix, tuple(labels.items()))
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def add_histogram(self, histogram: Histogram, **labels):
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            self.add(count, "_bucket", **labels, le=bound)
+        self.add(snapshot["count"], "_count", **labels)
+        self.add(snapshot["sum"], "_sum", **labels)
+
+    def dump(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "help": self.help,
+            "samples": [[name, list(labels), value] for (name, labels), value in self.samples.items()],
+        }
+
+    @classmethod
+    def load(cls, data: dict):
+        family = cls(data["name"], data["kind"], data["help"])
+        for name, labels, value in data["samples"]:
+            family.samples[(name, tuple(tuple(pair) for pair in labels))] = value
+        return family
+
+
+def merge(*family_lists):
+    merged = {}
+    for families in family_lists:
+        for family in families:
+            target = merged.get(family.name)
+            if target is None:
+                target = merged[family.name] = Family(family.name, family.kind, family.help)
+            for key, value in family.samples.items():
+                target.samples[key] = target.samples.get(key, 0) + value
+    return list(merged.values())
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families) -> str:
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for (name, labels), value in family.samples.items():
+            if labels:
+                label_text = ",".join(f'{label}="{escape(label_value)}"' for label, label_value in labels)
+                lines.append(f"{name}{{{label_text}}} {float(value)!r}")
+            else:
+                lines.append(f"{name} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+# Multi-worker mode: every worker periodically dumps its families to
+# <directory>/<pid>.json and a scrape of any worker merges all the files.
+# Files of exited workers are kept so counters never go backwards; clear the
+# directory when the service (not a single worker) starts. Gauges describe a
+# live process (pool checkouts, queue sizes), so an exited worker's are dropped.
+def write_snapshot(directory: str, families):
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump([family.dump() for family in families], file)
+    os.replace(temporary, path)
+
+
+def alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots(directory: str, exclude_pid: int = None):
+    family_lists = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json") or filename == f"{exclude_pid}.json":
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                families = [Family.load(data) for data in json.load(file)]
+            if not alive(int(filename[:-len(".json")])):
+                families = [family for family in families if family.kind != "gauge"]
+        except (OSError, ValueError):
+            continue
+        family_lists.append(families)
+    return family_lists
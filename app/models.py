@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, TIMESTAMP, Boolean
+from sqlalchemy import Column, Integer, String, TIMESTAMP, Boolean, Index, ForeignKey
 
 
 from app.database import Base
@@ -9,6 +9,9 @@ metadata = Base.metadata
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_first_name_last_name", "first_name", "last_name"),
+    )
 
     id = Column(Integer, primary_key=True)
     email = Column(String, unique=True, nullable=False)
@@ -21,3 +24,14 @@ class User(Base):
     last_activity_at = Column(TIMESTAMP, default=datetime.utcnow)
     balance = Column(Integer, default=0)
     disabled = Column(Boolean, default=False)
+
+
+class BalanceOperation(Base):
+    __tablename__ = "balance_operations"
+
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    new_balance = Column(Integer, nullable=False)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
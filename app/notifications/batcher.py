@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import PUSH_BATCH_SIZE, PUSH_BATCH_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+# Coalesces pushes into one broker message per micro-batch: a batch is sent
+# when it reaches `max_size` tokens or `window` seconds after its first
+# token, whichever comes first. A token pushed again while its batch is
+# still pending is dropped.
+class PushBatcher:
+    def __init__(self, enqueue, max_size: int, window: float):
+        self.enqueue = enqueue
+        self.max_size = max_size
+        self.window = window
+        self.pending = {}
+        self.stats = {"accepted": 0, "deduplicated": 0, "batches": 0, "failed": 0}
+        self._timer = None
+        self._tasks = set()
+
+    async def add(self, device_token: str):
+        if device_token in self.pending:
+            self.stats["deduplicated"] += 1
+            return
+        self.stats["accepted"] += 1
+        self.pending[device_token] = None
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_in_background)
+
+    def _flush_in_background(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+        device_tokens = list(self.pending)
+        self.pending = {}
+        try:
+            # publishing is blocking network I/O
+            await run_in_threadpool(self.enqueue, device_tokens)
+            self.stats["batches"] += 1
+        except Exception:
+            self.stats["failed"] += len(device_tokens)
+            logger.exception("Could not enqueue %d push notifications", len(device_tokens))
+
+    async def close(self):
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+# Celery is only loaded once the first batch goes out, not when the app imports
+def enqueue_batch(device_tokens: list[str]):
+    from app.log_save.celery_tasks import send_notifications
+
+    send_notifications.apply_async((device_tokens,))
+
+
+push_batcher = PushBatcher(enqueue_batch, PUSH_BATCH_SIZE, PUSH_BATCH_WINDOW)
@@ -0,0 +1,132 @@
+"""Dead-lettered push notifications: inspect and replay.
+
+    python -m app.notifications.dead_letter count
+    python -m app.notifications.dead_letter show --limit 20
+    python -m app.notifications.dead_letter replay --limit 10000
+
+Workers push here once a notification has used up its retries. Replay takes
+entries off the list and enqueues them again as send_notifications batches.
+"""
+import argparse
+import json
+import logging
+import time
+from itertools import groupby
+
+from app.config import PUSH_BATCH_SIZE, REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_KEY = "notifications:dead_letter"
+# entries a replay has taken but not yet published
+REPLAYING_KEY = "notifications:dead_letter:replaying"
+# delivery outcome counters shared by all workers, read by /metrics
+STATS_KEY = "notifications:stats"
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        import redis
+
+        _client = redis.Redis.from_url(REDIS_URL, socket_timeout=5, socket_connect_timeout=5)
+    return _client
+
+
+def record(outcome: str, count: int = 1):
+    from redis import RedisError
+
+    if not count:
+        return
+    try:
+        client().hincrby(STATS_KEY, outcome, count)
+    except RedisError:
+        logger.exception("Could not record %d %s notifications", count, outcome)
+
+
+def stats():
+    return {outcome.decode(): int(count) for outcome, count in client().hgetall(STATS_KEY).items()}
+
+
+def push(device_tokens: list[str], message: dict, error: str, attempts: int):
+    failed_at = time.time()
+    entries = [
+        json.dumps({
+            "device_token": device_token, "message": message, "error": error,
+            "attempts": attempts, "failed_at": failed_at,
+        })
+        for device_token in device_tokens
+    ]
+    client().lpush(DEAD_LETTER_KEY, *entries)
+
+
+def depth():
+    return client().llen(DEAD_LETTER_KEY)
+
+
+# oldest first, the order replay takes them in
+def peek(limit: int):
+    return [json.loads(entry) for entry in reversed(client().lrange(DEAD_LETTER_KEY, -limit, -1))]
+
+
+# REPLAYING_KEY holds the newest entry on the left, so moving from the left
+# onto the tail of the dead-letter list puts the oldest back at its tail
+def restore():
+    restored = 0
+    while client().lmove(REPLAYING_KEY, DEAD_LETTER_KEY, "LEFT", "RIGHT") is not None:
+        restored += 1
+    return restored
+
+
+def take(count: int):
+    pipeline = client().pipeline()
+    for _ in range(count):
+        pipeline.lmove(DEAD_LETTER_KEY, REPLAYING_KEY, "RIGHT", "LEFT")
+    return [json.loads(entry) for entry in pipeline.execute() if entry is not None]
+
+
+# Oldest first. A batch is moved to REPLAYING_KEY and each group is dropped
+# from it only once published; a failed publish (the broker is often still
+# down after an outage) puts the rest back and re-raises, and entries left by
+# a crashed replay are restored by the next one. At least once, never lost.
+def replay(limit: int, enqueue, batch_size: int = PUSH_BATCH_SIZE):
+    restore()
+    replayed = 0
+    while replayed < limit:
+        entries = take(min(batch_size, limit - replayed))
+        if not entries:
+            break
+        try:
+            for message, group in groupby(entries, key=lambda entry: json.dumps(entry["message"], sort_keys=True)):
+                device_tokens = [entry["device_token"] for entry in group]
+                enqueue(device_tokens, json.loads(message))
+                client().rpop(REPLAYING_KEY, len(device_tokens))
+                replayed += len(device_tokens)
+        except Exception:
+            restore()
+            raise
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["count", "show", "replay"])
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "count":
+        print(depth())
+    elif args.command == "show":
+        for entry in peek(args.limit):
+            print(json.dumps(entry))
+    else:
+        from app.log_save.celery_tasks import send_notifications
+
+        replayed = replay(args.limit, lambda device_tokens, message: send_notifications.delay(device_tokens, message))
+        print(f"replayed {replayed} notifications")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from app.config import NOTIFY_BREAKER_FAILURES, NOTIFY_BREAKER_RESET, NOTIFY_PROVIDER, NOTIFY_PROVIDER_CONCURRENCY, \
+    NOTIFY_TIMEOUT
+from app.notifications.providers import PushError, PushProvider, build_provider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 100
+
+
+class CircuitOpenError(PushError):
+    pass
+
+
+# Opens after `failure_threshold` consecutive failures and then fails pushes
+# fast for `reset_timeout` seconds; after that a single trial push decides
+# whether it closes again.
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def check(self):
+        if self.state == "closed":
+            return
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return
+        raise CircuitOpenError(f"circuit for provider {self.name} is {self.state}")
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Circuit for push provider %s closed", self.name)
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.error("Circuit for push provider %s opened after %d failures", self.name, self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+# Runs pushes concurrently on one event loop, at most `limits[name]` in
+# flight per provider so a slow provider can't take every connection, and
+# behind a per-provider circuit breaker so an outage isn't hammered.
+class NotificationDispatcher:
+    def __init__(
+        self,
+        providers: dict[str, PushProvider],
+        limits: dict[str, int] = None,
+        failure_threshold: int = NOTIFY_BREAKER_FAILURES,
+        reset_timeout: float = NOTIFY_BREAKER_RESET,
+    ):
+        self.providers = providers
+        self.limits = {name: (limits or {}).get(name, DEFAULT_CONCURRENCY) for name in providers}
+        self.breakers = {name: CircuitBreaker(name, failure_threshold, reset_timeout) for name in providers}
+        self._semaphores = {}
+
+    def semaphore(self, provider_name: str):
+        semaphore = self._semaphores.get(provider_name)
+        if semaphore is None:
+            semaphore = self._semaphores[provider_name] = asyncio.Semaphore(self.limits[provider_name])
+        return semaphore
+
+    async def send(self, provider_name: str, device_token: str, message: dict):
+        breaker = self.breakers[provider_name]
+        # fail fast without waiting for a concurrency slot
+        breaker.check()
+        async with self.semaphore(provider_name):
+            try:
+                await self.providers[provider_name].send(device_token, message)
+            except BaseException:
+                # cancellations and provider bugs resolve a half-open trial too
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+
+    # Returns one result per token: None when delivered, else the exception.
+    async def send_many(self, provider_name: str, device_tokens: list[str], message: dict):
+        return await asyncio.gather(
+            *(self.send(provider_name, device_token, message) for device_token in device_tokens),
+            return_exceptions=True,
+        )
+
+    async def close(self):
+        for provider in self.providers.values():
+            await provider.close()
+
+
+# A dispatcher on an event loop in a daemon thread, for synchronous callers
+# such as Celery tasks: concurrent tasks (threads/gevent pools) share one
+# loop and the provider limits.
+class BackgroundDispatcher:
+    def __init__(self, dispatcher: NotificationDispatcher):
+        self.dispatcher = dispatcher
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="notifications", daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine, timeout: float = None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def send(self, provider_name: str, device_token: str, message: dict, timeout: float = NOTIFY_TIMEOUT):
+        return self.run(self.dispatcher.send(provider_name, device_token, message), timeout)
+
+    def send_many(self, provider_name: str, device_tokens: list[str], message: dict, timeout: float = None):
+        return self.run(self.dispatcher.send_many(provider_name, device_tokens, message), timeout)
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+# one per process: threads pool tasks starting together must share the loop,
+# the provider limits and the circuit breakers
+def get_dispatcher() -> BackgroundDispatcher:
+    global _background
+    if _background is None:
+        with _background_lock:
+            if _background is None:
+                provider = build_provider(NOTIFY_PROVIDER)
+                dispatcher = NotificationDispatcher({provider.name: provider}, NOTIFY_PROVIDER_CONCURRENCY)
+                _background = BackgroundDispatcher(dispatcher)
+    return _background
+
+
+def reset_after_fork():
+    # the loop thread and provider connections don't survive fork, and the
+    # lock may have been held by a parent thread that doesn't exist here
+    global _background, _background_lock
+    _background = None
+    _background_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
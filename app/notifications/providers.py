@@ -0,0 +1,76 @@
+import asyncio
+import random
+from abc import ABC, abstractmethod
+
+import httpx
+
+from app.config import NOTIFY_FAKE_FAILURE_RATE, NOTIFY_FAKE_LATENCY, NOTIFY_HTTP_URL, NOTIFY_TIMEOUT
+
+
+class PushError(Exception):
+    pass
+
+
+# A provider delivers one push; it may be called concurrently from the
+# dispatcher's event loop, up to the provider's concurrency limit.
+class PushProvider(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def send(self, device_token: str, message: dict):
+        ...
+
+    async def close(self):
+        pass
+
+
+# Local stand-in for FCM/SNS: sleeps like a network call and fails at a
+# configurable rate.
+class FakePushProvider(PushProvider):
+    name = "fake"
+
+    def __init__(self, latency: float = NOTIFY_FAKE_LATENCY, failure_rate: float = NOTIFY_FAKE_FAILURE_RATE):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = 0
+
+    async def send(self, device_token: str, message: dict):
+        await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise PushError(f"fake delivery to {device_token} failed")
+        self.sent += 1
+
+
+# Posts each push as JSON to a gateway URL (e.g. an FCM/SNS relay) over a
+# shared keep-alive connection pool.
+class HttpPushProvider(PushProvider):
+    name = "http"
+
+    def __init__(self, url: str = NOTIFY_HTTP_URL, timeout: float = NOTIFY_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._client = None
+
+    async def send(self, device_token: str, message: dict):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        try:
+            response = await self._client.post(self.url, json={"device_token": device_token, **message})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise PushError(f"push to {device_token} failed: {e}") from e
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+PROVIDERS = {provider.name: provider for provider in (FakePushProvider, HttpPushProvider)}
+
+
+def build_provider(name: str) -> PushProvider:
+    try:
+        return PROVIDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown push provider {name!r}; expected one of {sorted(PROVIDERS)}") from None
@@ -0,0 +1,53 @@
+import time
+from collections import defaultdict
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app import query_stats
+from app.metrics import Histogram
+
+# keyed by pool logging name, which survives pool.recreate() on dispose
+wait_seconds = defaultdict(Histogram)
+timeouts = defaultdict(int)
+pools = {}
+
+
+class TimedPoolMixin:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeouts[self.logging_name] += 1
+            raise
+        finally:
+            wait_seconds[self.logging_name].observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def register(engine):
+    pools[engine.pool.logging_name] = engine
+    return query_stats.instrument(engine)
+
+
+def snapshot():
+    stats = {}
+    for name, engine in pools.items():
+        pool = engine.pool
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "timeouts": timeouts[name],
+            "wait_seconds": wait_seconds[name].snapshot(),
+        }
+    return stats
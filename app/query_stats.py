@@ -0,0 +1,38 @@
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from app.metrics import Histogram
+from app.sql_profiler import current_profile
+
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# keyed by pool logging name, like pool_stats
+query_seconds = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+errors = defaultdict(int)
+
+
+def instrument(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    name = sync_engine.pool.logging_name
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        query_seconds[name].observe(elapsed)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record(statement, parameters, elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        errors[name] += 1
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+    return engine
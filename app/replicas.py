@@ -0,0 +1,67 @@
+import itertools
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# zero while the replica has replayed everything it received, so an idle
+# primary does not make its replicas look stale
+LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    def __init__(self, session_factories: list, max_lag: float, check_interval: float):
+        self.session_factories = session_factories
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(session_factories) if session_factories else iter(())
+        self._state = {}
+
+    def _cached(self, factory):
+        checked_at, fresh = self._state.get(factory, (None, False))
+        if checked_at is not None and time.monotonic() - checked_at < self.check_interval:
+            return fresh
+        return None
+
+    def _record(self, factory, lag):
+        fresh = lag is not None and lag <= self.max_lag
+        if not fresh:
+            logger.warning("Replica %s skipped, lag: %s", factory.kw["bind"].url.host, lag)
+        self._state[factory] = (time.monotonic(), fresh)
+        return fresh
+
+    def pick(self):
+        for _ in self.session_factories:
+            factory = next(self._cycle)
+            fresh = self._cached(factory)
+            if fresh is None:
+                try:
+                    with factory.kw["bind"].connect() as connection:
+                        lag = connection.scalar(LAG_QUERY)
+                except SQLAlchemyError:
+                    lag = None
+                fresh = self._record(factory, lag)
+            if fresh:
+                return factory
+        return None
+
+    async def pick_async(self):
+        for _ in self.session_factories:
+            factory = next(self._cycle)
+            fresh = self._cached(factory)
+            if fresh is None:
+                try:
+                    async with factory.kw["bind"].connect() as connection:
+                        lag = await connection.scalar(LAG_QUERY)
+                except (SQLAlchemyError, OSError):
+                    lag = None
+                fresh = self._record(factory, lag)
+            if fresh:
+                return factory
+        return None
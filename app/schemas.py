@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
 
 class UserBase(BaseModel):
@@ -28,6 +28,18 @@ class UserChangeName(UserBase):
     new_last_name: str
 
 
+class BalanceOperation(BaseModel):
+    first_name: str
+    last_name: str
+    amount: int = Field(gt=0)
+
+
+class BalanceOperationResult(BalanceOperation):
+    success: bool
+    new_balance: Optional[int] = None
+    detail: Optional[str] = None
+
+
 class User(UserBase):
     id: int
     email: str
@@ -42,6 +54,21 @@ class User(UserBase):
         from_attributes = True
 
 
+# /get_users lists rows as stored, including ones whose nullable columns are unset
+class UserListItem(BaseModel):
+    id: int
+    email: str
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    balance: Optional[float] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    last_activity_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,151 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import NamedTuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, asc, desc, false, or_, tuple_
+
+from app import models
+
+SORTABLE_COLUMNS = {
+    "id": models.User.id,
+    "email": models.User.email,
+    "username": models.User.username,
+    "first_name": models.User.first_name,
+    "last_name": models.User.last_name,
+    "balance": models.User.balance,
+    "created_at": models.User.created_at,
+    "updated_at": models.User.updated_at,
+    "last_activity_at": models.User.last_activity_at,
+}
+
+# btree indexes on users, by leading columns; a sort can be served by an index
+# when its keys are a prefix of the index columns and share one direction
+INDEXES = {
+    "users_pkey": ("id",),
+    "users_email_key": ("email",),
+    "users_username_key": ("username",),
+    "ix_users_first_name_last_name": ("first_name", "last_name"),
+}
+
+
+class SortKey(NamedTuple):
+    name: str
+    descending: bool
+
+    @property
+    def column(self):
+        return SORTABLE_COLUMNS[self.name]
+
+    @property
+    def nullable(self):
+        return self.column.nullable
+
+
+# "last_name,-first_name": comma separated keys, "-" flips `order` for one key;
+# id is always appended as the final tie-breaker
+def parse_sort(sort_by: str = "id", order: str = "asc"):
+    keys = []
+    for item in sort_by.split(","):
+        name = item.strip().lstrip("-")
+        if name not in SORTABLE_COLUMNS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot sort by '{name}', expected one of: {', '.join(SORTABLE_COLUMNS)}",
+            )
+        if name in (key.name for key in keys):
+            continue
+        keys.append(SortKey(name, (order == "desc") != item.strip().startswith("-")))
+        if name == "id":
+            break
+    if keys[-1].name != "id":
+        keys.append(SortKey("id", keys[-1].descending))
+    return keys
+
+
+def backing_index(keys: list[SortKey]):
+    names = tuple(key.name for key in keys)
+    if names[-1] == "id" and len(names) > 1:
+        names = names[:-1]
+    if len({key.descending for key in keys}) > 1:
+        return None
+    for index, columns in INDEXES.items():
+        if columns[:len(names)] == names:
+            return index
+    return None
+
+
+def check_sort_cost(keys: list[SortKey], narrowed: bool):
+    if narrowed or backing_index(keys) is not None:
+        return
+    raise HTTPException(
+        status_code=400,
+        detail="Sort requires a full table sort; filter by user_id or first_name, "
+               "or sort by an indexed key: id, email, username, first_name[,last_name]",
+    )
+
+
+def order_by(keys: list[SortKey]):
+    return [desc(key.column) if key.descending else asc(key.column) for key in keys]
+
+
+def equal(key: SortKey, value):
+    return key.column.is_(None) if value is None else key.column == value
+
+
+# Postgres sorts NULLs last ascending and first descending, i.e. as the
+# greatest value, so that is what "after" means for a NULL on either side
+def after(key: SortKey, value):
+    if value is None:
+        return key.column.is_not(None) if key.descending else false()
+    if key.descending:
+        return key.column < value
+    return or_(key.column > value, key.column.is_(None)) if key.nullable else key.column > value
+
+
+# rows strictly after `values` in the sort order; a single row-value comparison
+# when all keys share a direction and are NOT NULL, so the index range scan
+# still applies (a NULL in a row value would drop the row from every page)
+def keyset_filter(keys: list[SortKey], values: list):
+    if len({key.descending for key in keys}) == 1 and not any(key.nullable for key in keys):
+        columns = tuple_(*(key.column for key in keys))
+        bound = tuple_(*values)
+        return columns < bound if keys[0].descending else columns > bound
+    clauses = []
+    for position, key in enumerate(keys):
+        equal_before = [equal(k, v) for k, v in zip(keys[:position], values)]
+        clauses.append(and_(*equal_before, after(key, values[position])))
+    return or_(*clauses)
+
+
+def encode_cursor(user: models.User, keys: list[SortKey]):
+    values = []
+    for key in keys:
+        value = getattr(user, key.name)
+        values.append(value.isoformat() if isinstance(value, datetime) else value)
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_value(key: SortKey, value):
+    if value is None:
+        if not key.nullable:
+            raise ValueError(key.name)
+        return None
+    python_type = key.column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    # type() rather than isinstance() so true/false are not taken as integers
+    if type(value) is not python_type:
+        raise TypeError(key.name)
+    return value
+
+
+def decode_cursor(cursor: str, keys: list[SortKey]):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [decode_value(key, value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
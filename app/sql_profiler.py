@@ -0,0 +1,79 @@
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from app.config import SQL_PROFILE_MAX_QUERIES
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENT_LENGTH = 200
+
+
+class Profile:
+    def __init__(self):
+        self.statements = []
+
+    def record(self, statement: str, parameters, seconds: float):
+        self.statements.append((statement, repr(parameters), seconds))
+
+    # "duplicates" ran with identical parameters and could be reused;
+    # "repeated" ran with different parameters, the usual N+1 shape.
+    def summary(self):
+        by_text = Counter(statement for statement, _, _ in self.statements)
+        by_call = Counter((statement, parameters) for statement, parameters, _ in self.statements)
+        repeated = {statement: count for statement, count in by_text.items() if count > 1}
+        return {
+            "queries": len(self.statements),
+            "time_ms": round(sum(seconds for _, _, seconds in self.statements) * 1000, 3),
+            "duplicates": sum(count - 1 for count in by_call.values()),
+            "repeated": sum(count - 1 for count in repeated.values()),
+            "top": [
+                {"statement": statement[:MAX_STATEMENT_LENGTH], "count": count}
+                for statement, count in Counter(repeated).most_common(3)
+            ],
+        }
+
+
+current_profile: ContextVar[Optional[Profile]] = ContextVar("sql_profile", default=None)
+
+
+def header_value(summary: dict) -> bytes:
+    return (
+        f"queries={summary['queries']};time_ms={summary['time_ms']};"
+        f"duplicates={summary['duplicates']};repeated={summary['repeated']}"
+    ).encode()
+
+
+# Opt-in (SQL_PROFILE): records every statement of a request through the
+# cursor events in query_stats. The X-SQL-Profile header covers statements
+# run before the response started; the log record covers the whole request,
+# including streamed bodies.
+class SqlProfileMiddleware:
+    def __init__(self, app, max_queries=SQL_PROFILE_MAX_QUERIES):
+        self.app = app
+        self.max_queries = max_queries
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile()
+        current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"x-sql-profile", header_value(profile.summary()))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.set(None)
+            summary = profile.summary()
+            if summary["duplicates"] or summary["repeated"] or summary["queries"] > self.max_queries:
+                level = logging.WARNING
+            else:
+                level = logging.INFO
+            logger.log(level, "SQL profile for %s %s", scope["method"], scope["path"], extra={"sql": summary})
@@ -0,0 +1,157 @@
+import os
+import logging
+import threading
+
+from app import cache_token, hashing, http_stats, pool_stats, query_stats
+from app.config import METRICS_FLUSH_INTERVAL, METRICS_MULTIPROC_DIR, NOTIFY_QUEUE
+from app.metrics import Family, merge, read_snapshots, render, write_snapshot
+from app.notifications import dead_letter
+from app.notifications.batcher import push_batcher
+
+logger = logging.getLogger(__name__)
+
+
+# Runs off the event loop (sync /metrics, the snapshot writer) while requests
+# add keys, so every dict is copied with list() before iterating.
+def collect():
+    requests = Family("http_requests_total", "counter", "HTTP requests by route and status.")
+    for (method, route, status_code), count in list(http_stats.requests.items()):
+        requests.add(count, method=method, route=route, status=status_code)
+    request_seconds = Family("http_request_duration_seconds", "histogram", "HTTP request latency by route.")
+    for (method, route), histogram in list(http_stats.request_seconds.items()):
+        request_seconds.add_histogram(histogram, method=method, route=route)
+
+    query_seconds = Family("db_query_duration_seconds", "histogram", "SQL statement execution time by engine.")
+    for name, histogram in list(query_stats.query_seconds.items()):
+        query_seconds.add_histogram(histogram, engine=name)
+    query_errors = Family("db_query_errors_total", "counter", "Failed SQL statements by engine.")
+    for name, count in list(query_stats.errors.items()):
+        query_errors.add(count, engine=name)
+
+    pool_checked_out = Family("db_pool_checked_out", "gauge", "Connections currently checked out of the pool.")
+    pool_timeouts = Family("db_pool_timeouts_total", "counter", "Pool checkouts that timed out.")
+    pool_wait = Family("db_pool_wait_seconds", "histogram", "Time spent waiting for a pooled connection.")
+    for name, engine in list(pool_stats.pools.items()):
+        pool_checked_out.add(engine.pool.checkedout(), pool=name)
+        pool_timeouts.add(pool_stats.timeouts[name], pool=name)
+        pool_wait.add_histogram(pool_stats.wait_seconds[name], pool=name)
+
+    token_cache = Family("token_cache_requests_total", "counter", "Token cache lookups by result.")
+    for result, count in list(cache_token.stats.items()):
+        token_cache.add(count, result=result)
+
+    hashing_seconds = Family("password_hashing_seconds", "histogram", "bcrypt call time, including queueing.")
+    hashing_rejected = Family("password_hashing_rejected_total", "counter", "bcrypt calls rejected as over capacity.")
+    for func, histogram in list(hashing.pool.seconds.items()):
+        hashing_seconds.add_histogram(histogram, func=func)
+    for func, rejected in list(hashing.pool.rejected.items()):
+        hashing_rejected.add(rejected, func=func)
+
+    pushes = Family("push_enqueue_total", "counter", "Pushes received by /push, by outcome.")
+    for outcome in ("accepted", "deduplicated", "failed"):
+        pushes.add(push_batcher.stats[outcome], outcome=outcome)
+    push_batches = Family("push_batches_total", "counter", "Push micro-batches published to the broker.")
+    push_batches.add(push_batcher.stats["batches"])
+
+    return [
+        requests, request_seconds, query_seconds, query_errors, pool_checked_out, pool_timeouts, pool_wait,
+        token_cache, hashing_seconds, hashing_rejected, pushes, push_batches,
+    ]
+
+
+# Ratios don't sum across workers, so they are derived after merging.
+def token_cache_hit_ratio(families):
+    counts = {}
+    for family in families:
+        if family.name == "token_cache_requests_total":
+            counts = {dict(labels)["result"]: value for (_, labels), value in family.samples.items()}
+    ratio = Family("token_cache_hit_ratio", "gauge", "Share of token cache lookups that were hits.")
+    lookups = counts.get("hits", 0) + counts.get("misses", 0)
+    ratio.add(counts.get("hits", 0) / lookups if lookups else 0)
+    return ratio
+
+
+# Pending tasks wait on the Celery broker (CELERY_BROKER_URL, not necessarily
+# REDIS_URL); asked through kombu so any broker transport reports its depth.
+def broker_queue_depth(queue: str):
+    from app.celery_app import celery
+
+    with celery.connection_for_read() as connection:
+        try:
+            return connection.channel().queue_declare(queue, passive=True).message_count
+        except connection.channel_errors:
+            # never declared, so nothing has been queued yet
+            return 0
+        except connection.connection_errors:
+            logger.warning("Broker queue depth unavailable", exc_info=True)
+            return None
+
+
+# Notification workers are separate processes, so their counters and the queue
+# depths live in Redis and the broker. They are already global: read live,
+# never merged.
+def collect_notifications():
+    from redis import RedisError
+
+    try:
+        outcomes = dead_letter.stats()
+        dead_letter_depth = dead_letter.depth()
+    except RedisError:
+        logger.warning("Notification metrics unavailable", exc_info=True)
+        return []
+    queue_depth = broker_queue_depth(NOTIFY_QUEUE)
+
+    notifications = Family("notifications_total", "counter", "Push delivery attempts by outcome.")
+    for outcome in ("delivered", "failed", "retried", "dead_lettered"):
+        notifications.add(outcomes.get(outcome, 0), outcome=outcome)
+    attempts = outcomes.get("delivered", 0) + outcomes.get("failed", 0)
+    failure_ratio = Family("notifications_failure_ratio", "gauge", "Share of push attempts that failed.")
+    failure_ratio.add(outcomes.get("failed", 0) / attempts if attempts else 0)
+    depth = Family("notifications_queue_depth", "gauge", "Messages waiting in the notification queues.")
+    if queue_depth is not None:
+        depth.add(queue_depth, queue=NOTIFY_QUEUE)
+    depth.add(dead_letter_depth, queue="dead_letter")
+    return [notifications, failure_ratio, depth]
+
+
+def render_metrics():
+    families = collect()
+    if METRICS_MULTIPROC_DIR:
+        families = merge(families, *read_snapshots(METRICS_MULTIPROC_DIR, exclude_pid=os.getpid()))
+    return render(families + [token_cache_hit_ratio(families)] + collect_notifications())
+
+
+class SnapshotWriter:
+    def __init__(self, directory: str, interval: float):
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        try:
+            write_snapshot(self.directory, collect())
+        except Exception:
+            # a failed write must not end the thread, or aggregation stops silently
+            logger.exception("Could not write metrics snapshot to %s", self.directory)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write()
+
+
+snapshot_writer = SnapshotWriter(METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL) if METRICS_MULTIPROC_DIR else None
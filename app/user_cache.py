@@ -0,0 +1,84 @@
+import logging
+import time
+from collections import OrderedDict
+
+from app import models
+from app.cache_token import get_cache
+from app.config import USER_CACHE_LOCAL_TTL, USER_CACHE_SIZE, USER_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+CACHED_COLUMNS = [column.key for column in models.User.__table__.columns if column.key != "hashed_password"]
+
+
+class LocalCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+# Other workers only see Redis invalidations once their local entry expires,
+# so USER_CACHE_LOCAL_TTL bounds cross-worker staleness.
+local_cache = LocalCache(USER_CACHE_SIZE, USER_CACHE_LOCAL_TTL)
+
+
+def cache_key(username: str):
+    return f"user:{username}"
+
+
+async def get_user(username: str):
+    data = local_cache.get(username)
+    if data is None:
+        try:
+            data = await get_cache().get(cache_key(username))
+        except Exception:
+            logger.exception("User cache read failed for %s", username)
+            return None
+        if data is None:
+            return None
+        local_cache.set(username, data)
+    return models.User(**data)
+
+
+async def set_user(user: models.User):
+    data = {column: getattr(user, column) for column in CACHED_COLUMNS}
+    local_cache.set(user.username, data)
+    try:
+        await get_cache().set(cache_key(user.username), data, ttl=USER_CACHE_TTL)
+    except Exception:
+        logger.exception("User cache write failed for %s", user.username)
+
+
+async def invalidate_user(*usernames: str):
+    usernames = [username for username in usernames if username is not None]
+    for username in usernames:
+        local_cache.delete(username)
+    try:
+        for username in usernames:
+            await get_cache().delete(cache_key(username))
+    except Exception:
+        logger.exception("User cache invalidation failed for %s", ", ".join(usernames))
@@ -0,0 +1,75 @@
+"""Cold start of a worker: importing app.main, then running its lifespan startup.
+
+Each run is a fresh interpreter, as a newly scaled-out worker would be:
+
+    python -m benchmarks.import_time --runs 10 --top 15
+
+--top lists the slowest modules from `python -X importtime` (cumulative).
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT = """
+import json, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({"import_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+STARTUP = """
+import asyncio, json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def startup():
+    async with app.main.lifespan(app.main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(json.dumps({"import_ms": (imported - start) * 1000, "startup_ms": (ready - imported) * 1000}))
+"""
+
+
+def measure(code: str, runs: int):
+    results = [
+        json.loads(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout)
+        for _ in range(runs)
+    ]
+    return {key: statistics.median(result[key] for result in results) for key in results[0]}
+
+
+def slowest_modules(top: int):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], check=True, capture_output=True, text=True
+    ).stderr
+    modules = []
+    for line in stderr.splitlines()[1:]:
+        _, own, cumulative, name = (field.strip() for field in line.replace(":", "|", 1).split("|"))
+        modules.append((int(cumulative), int(own), name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=0, help="show the N slowest imports")
+    parser.add_argument("--no-startup", action="store_true", help="only time the import (no lifespan)")
+    args = parser.parse_args()
+
+    result = measure(IMPORT if args.no_startup else STARTUP, args.runs)
+    print(f"median of {args.runs} runs")
+    for key, value in result.items():
+        print(f"{key:<12} {value:>9.1f}")
+
+    if args.top:
+        print(f"\n{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative, own, name in slowest_modules(args.top):
+            print(f"{cumulative / 1000:>14.1f} {own / 1000:>9.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
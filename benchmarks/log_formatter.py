@@ -0,0 +1,80 @@
+"""Records/sec of the JSON log formatter, before and after the fast formatter.
+
+    python -m benchmarks.log_formatter --records 200000
+"""
+import argparse
+import json
+import logging
+import time
+
+from app.log_save import logger as log_module
+
+
+class LegacyJsonFormatter(logging.Formatter):
+    def format(self, record):
+        json_record = {}
+        json_record["message"] = record.getMessage()
+        if "req" in record.__dict__:
+            json_record["req"] = record.__dict__["req"]
+        if "res" in record.__dict__:
+            json_record["res"] = record.__dict__["res"]
+        if record.levelno == logging.ERROR and record.exc_info:
+            json_record["err"] = self.formatException(record.exc_info)
+        return json.dumps(json_record)
+
+
+# the legacy approach, emitting the same fields as the new formatter
+class NaiveJsonFormatter(logging.Formatter):
+    def format(self, record):
+        json_record = {
+            "level": record.levelname,
+            "logger": record.name,
+            "timestamp": self.formatTime(record),
+            "message": record.getMessage(),
+        }
+        for field in log_module.CONTEXT_FIELDS:
+            if field in record.__dict__:
+                json_record[field] = record.__dict__[field]
+        return json.dumps(json_record)
+
+
+def make_records(count: int):
+    records = []
+    for i in range(count):
+        record = logging.LogRecord("app.main", logging.INFO, __file__, 1, "Getting balance for user: %s %s",
+                                   ("Bob", f"Test{i}"), None)
+        if i % 2:
+            record.req = {"method": "GET", "url": f"http://testserver/balance?first_name=Bob&last_name=Test{i}"}
+            record.res = {"status_code": 200}
+            record.request_id = "9f1c2d6e0b7a4c3e8d5f6a7b8c9d0e1f"
+            record.user_id = i
+            record.latency_ms = 1.234
+        records.append(record)
+    return records
+
+
+def measure(formatter, records):
+    start = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+    records = make_records(args.records)
+
+    print(f"{'formatter':<28} {'records/sec':>12}")
+    print(f"{'legacy (message/req/res)':<28} {measure(LegacyJsonFormatter(), records):>12.0f}")
+    print(f"{'legacy, all fields':<28} {measure(NaiveJsonFormatter(), records):>12.0f}")
+    log_module.dumps = log_module.json_dumps
+    print(f"{'JsonFormatter (json)':<28} {measure(log_module.JsonFormatter(), records):>12.0f}")
+    if log_module.orjson is not None:
+        log_module.dumps = log_module.orjson_dumps
+        print(f"{'JsonFormatter (orjson)':<28} {measure(log_module.JsonFormatter(), records):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Notifications/sec for one worker process: blocking pushes vs the dispatcher.
+
+Uses the fake provider, so no broker or network is needed:
+
+    python -m benchmarks.notifications --latency 0.05 --notifications 5000
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.notifications.dispatcher import BackgroundDispatcher, NotificationDispatcher
+from app.notifications.providers import FakePushProvider
+
+MESSAGE = {"title": "Benchmark"}
+
+
+# the old task: one blocking call per notification per worker process
+def blocking(latency: float, notifications: int):
+    start = time.perf_counter()
+    for _ in range(notifications):
+        time.sleep(latency)
+    return notifications / (time.perf_counter() - start)
+
+
+def make_dispatcher(latency: float, concurrency: int):
+    provider = FakePushProvider(latency=latency, failure_rate=0)
+    return BackgroundDispatcher(NotificationDispatcher({provider.name: provider}, {provider.name: concurrency}))
+
+
+# one task per notification on a Celery threads pool of `threads`
+def task_per_notification(latency: float, notifications: int, concurrency: int, threads: int):
+    dispatcher = make_dispatcher(latency, concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda n: dispatcher.send("fake", f"device{n}", MESSAGE), range(notifications)))
+    return notifications / (time.perf_counter() - start)
+
+
+# every notification handed to the dispatcher at once
+def fan_out(latency: float, notifications: int, concurrency: int):
+    dispatcher = make_dispatcher(latency, concurrency)
+    start = time.perf_counter()
+    dispatcher.send_many("fake", [f"device{n}" for n in range(notifications)], MESSAGE)
+    return notifications / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated provider round trip, seconds")
+    parser.add_argument("--notifications", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200, help="provider in-flight limit")
+    parser.add_argument("--threads", type=int, default=100, help="Celery threads pool size")
+    args = parser.parse_args()
+
+    print(f"{'mode':<40} {'notifications/sec':>18}")
+    print(f"{'blocking task (old)':<40} {blocking(args.latency, max(1, int(1 / args.latency))):>18.1f}")
+    rate = task_per_notification(args.latency, args.notifications, args.concurrency, args.threads)
+    print(f"{f'dispatcher, {args.threads} task threads':<40} {rate:>18.1f}")
+    rate = fan_out(args.latency, args.notifications, args.concurrency)
+    print(f"{f'dispatcher, send_many':<40} {rate:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
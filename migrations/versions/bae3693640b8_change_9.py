@@ -0,0 +1,30 @@
+"""Change_9
+
+Revision ID: bae3693640b8
+Revises: beb979318648
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bae3693640b8'
+down_revision: Union[str, None] = 'beb979318648'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps users writable while the index builds on a large table
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_first_name_last_name', 'users', ['first_name', 'last_name'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_first_name_last_name', table_name='users', postgresql_concurrently=True)
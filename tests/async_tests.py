@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+
+import pytest
+
+# DB_ASYNC is read when app.config is imported, so this module runs in its own
+# process, against the same database as tests.py:
+#   python -m pytest tests/async_tests.py
+if "app.config" in sys.modules and not sys.modules["app.config"].DB_ASYNC:
+    pytest.skip("app already imported with DB_ASYNC=false; run this module on its own", allow_module_level=True)
+os.environ.update(
+    DB_ASYNC="true", DB_USER="admin", DB_PASS="password", DB_HOST="localhost", DB_PORT="5452", DB_NAME="test",
+)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+from app.main import app
+from app import database, pool_stats
+from app.auth import create_access_token
+from app.database import Base
+from app.hashing import pool as hashing_pool
+
+engine = create_engine(database.SQLALCHEMY_DATABASE_URL)
+Base.metadata.drop_all(bind=engine)
+Base.metadata.create_all(bind=engine)
+engine.dispose()
+
+
+# One client for the module: entering it runs the lifespan and keeps a single
+# event loop, which the asyncpg pool is bound to, until the last test.
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def auth_headers():
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'async'})}"}
+
+
+def test_uses_async_engine(client):
+    assert database.get_session is database.get_async_db
+    assert database.resources().async_engine is not None
+
+
+def test_register(client):
+    response = client.post("/register", json={
+        "email": "async@example.com",
+        "username": "async",
+        "password": "asyncpassword",
+        "first_name": "Ann",
+        "last_name": "Async",
+        "balance": 100
+    })
+    assert response.status_code == 200
+    assert response.json()["email"] == "async@example.com"
+
+    response = client.post("/register", json={
+        "email": "async@example.com", "username": "async2", "password": "asyncpassword",
+        "first_name": "Ann", "last_name": "Again", "balance": 1,
+    })
+    assert response.status_code == 400
+
+
+def test_register_hashing_pool_saturated(client):
+    capacity = hashing_pool.capacity
+    hashing_pool.capacity = 0
+    try:
+        response = client.post("/register", json={
+            "email": "busy@example.com",
+            "username": "busy",
+            "password": "testpassword",
+            "first_name": "Busy",
+            "last_name": "Test",
+            "balance": 100
+        })
+    finally:
+        hashing_pool.capacity = capacity
+    assert response.status_code == 429
+
+
+def test_login(client):
+    response = client.post("/login", json={"email": "async@example.com"})
+    assert response.status_code == 200
+    assert response.json()["message"] == "You are now logged in"
+
+
+def test_change_password(client):
+    response = client.post("/change_password", json={
+        "email": "async@example.com",
+        "password": "asyncpassword",
+        "new_password": "newpassword",
+        "confirm_new_password": "newpassword"
+    })
+    assert response.status_code == 200
+
+
+def test_token(client):
+    response = client.post("/token", data={"username": "async", "password": "newpassword"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+
+    response = client.post("/token", data={"username": "async", "password": "asyncpassword"})
+    assert response.status_code == 401
+
+
+def test_read_users_me(client):
+    response = client.get("/users/me/", headers=auth_headers())
+    assert response.status_code == 200
+    assert response.json()["balance"] == 100
+
+
+def test_import_users(client):
+    body = (
+        "email,username,password,first_name,last_name,balance\n"
+        "aimp1@example.com,aimp1,pw1,Imp,One,5\n"
+        "async@example.com,async,pw,Ann,Async,5\n"
+    )
+    response = client.post("/users/import?format=csv", content=body, headers=auth_headers())
+    assert response.status_code == 200
+    assert response.json() == {
+        "processed": 2, "inserted": 1, "existing": 1, "duplicates": 0, "invalid": 0, "done": True,
+    }
+
+
+def test_get_users(client):
+    response = client.get("/get_users?limit=1&sort_by=email")
+    assert response.status_code == 200
+    assert [user["email"] for user in response.json()] == ["aimp1@example.com"]
+
+    response = client.get(f"/get_users?limit=1&sort_by=email&cursor={response.headers['X-Next-Cursor']}")
+    assert [user["email"] for user in response.json()] == ["async@example.com"]
+
+
+def test_get_users_ndjson(client):
+    response = client.get("/get_users?format=ndjson")
+    assert response.status_code == 200
+    assert [json.loads(line)["email"] for line in response.text.splitlines()] == [
+        "async@example.com", "aimp1@example.com",
+    ]
+
+
+def test_balance_operations(client):
+    assert client.get("/balance?first_name=Ann&last_name=Async").json()["balance"] == 100
+
+    response = client.put("/withdraw_balance?first_name=Ann&last_name=Async&amount=30",
+                          headers={"Idempotency-Key": "async-1"})
+    assert response.json() == {"message": "Balance updated", "new_balance": 70}
+    response = client.put("/withdraw_balance?first_name=Ann&last_name=Async&amount=30",
+                          headers={"Idempotency-Key": "async-1"})
+    assert response.json()["new_balance"] == 70
+    assert client.put("/withdraw_balance?first_name=Ann&last_name=Async&amount=1000").status_code == 400
+
+    response = client.post("/withdraw_balance/batch", json=[
+        {"first_name": "Ann", "last_name": "Async", "amount": 10},
+        {"first_name": "No", "last_name": "Body", "amount": 1},
+    ])
+    assert [result["new_balance"] for result in response.json()] == [60, None]
+    assert client.get("/users/me/", headers=auth_headers()).json()["balance"] == 60
+
+
+def test_profile(client):
+    response = client.get("/profile?first_name=Ann&last_name=Async")
+    assert response.status_code == 200
+    assert "hashed_password" not in response.json()
+
+    response = client.put("/update_profile", json={
+        "email": "async@example.com", "first_name": "Ann", "last_name": "Async",
+        "new_first_name": "Anna", "new_last_name": "Async",
+    })
+    assert response.status_code == 200
+    assert client.get("/profile?first_name=Anna&last_name=Async").status_code == 200
+    assert client.get("/profile?first_name=Ann&last_name=Async").status_code == 404
+
+
+def test_requests_used_the_async_pool(client):
+    assert pool_stats.snapshot()["async"]["wait_seconds"]["count"] > 0
+    assert pool_stats.snapshot()["primary"]["wait_seconds"]["count"] == 0